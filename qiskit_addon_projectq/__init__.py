@@ -9,6 +9,9 @@
 
 from .qasm_simulator_projectq import QasmSimulatorProjectQ
 from .statevector_simulator_projectq import StatevectorSimulatorProjectQ
+from .probability_simulator_projectq import ProbabilitySimulatorProjectQ
 from .projectqprovider import ProjectQProvider
+from .projectqcache import ResultCache
+from .projectqsnapshots import load_snapshot
 
 __version__ = '0.1.0'
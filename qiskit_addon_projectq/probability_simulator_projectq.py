@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018, IBM.
+#
+# This source code is licensed under the Apache License, Version 2.0 found in
+# the LICENSE.txt file in the root directory of this source tree.
+
+"""
+Exact probabilities and expectation values from the ProjectQ C++ simulator.
+"""
+
+import logging
+import time
+
+import numpy as np
+from qiskit.providers.models import BackendConfiguration
+
+from .projectqcompiler import MEASURE, bind_parameters, compile_circuit, fuse_gates
+from .projectqcppsim import CppSimulator
+from .projectqplanner import Footprint, count_snapshots, simulation_bytes, statevector_bytes
+from .projectqsimulatorerror import ProjectQSimulatorError
+from .qasm_simulator_projectq import (QasmSimulatorProjectQ, _close_snapshots, _discard_snapshots,
+                                      precision_dtype)
+try:
+    from projectq.ops import QubitOperator
+except ImportError:
+    pass
+
+logger = logging.getLogger(__name__)
+
+# Mapping basis states to outcomes takes about three int64 arrays over the
+# statevector, and each distinct outcome costs a hexadecimal key, a float
+# and a dictionary slot.
+_OUTCOME_MAPPING_BYTES_PER_AMPLITUDE = 24
+_PROBABILITY_ENTRY_BYTES = 160
+
+
+class ProbabilitySimulatorProjectQ(QasmSimulatorProjectQ):
+    """ProjectQ C++ simulator returning exact outcome probabilities.
+
+    Each experiment is simulated once, and instead of sampling shots its
+    result holds the exact probability of every outcome of the measured
+    memory slots. The ``observables`` option of the qobj config can list
+    ``QubitOperator`` objects, or strings such as ``'Z0 Z1'``, whose exact
+    expectation values in the state before the measurements are returned as
+    well.
+    """
+
+    DEFAULT_CONFIGURATION = {
+        'backend_name': 'projectq_probability_simulator',
+        'backend_version': '0.1.0',
+        'url': 'https://github.com/QISKit/qiskit-addon-projectq',
+        'simulator': True,
+        'local': True,
+        'description': 'A ProjectQ C++ simulator returning exact probabilities',
+        'basis_gates': ['u1', 'u2', 'u3', 'cx', 'id', 'h', 's', 't'],
+        'memory': False,
+        'n_qubits': 30,
+        'conditional': False,
+        'max_shots': 1,
+        'open_pulse': False,
+        'gates': [
+            {
+                'name': 'u1',
+                'parameters': ['lambda'],
+                'qasm_def': 'gate u1(lambda) q { U(0,0,lambda) q; }'
+            },
+            {
+                'name': 'u2',
+                'parameters': ['phi', 'lambda'],
+                'qasm_def': 'gate u2(phi,lambda) q { U(pi/2,phi,lambda) q; }'
+            },
+            {
+                'name': 'u3',
+                'parameters': ['theta', 'phi', 'lambda'],
+                'qasm_def': 'gate u3(theta,phi,lambda) q { U(theta,phi,lambda) q; }'
+            },
+            {
+                'name': 'cx',
+                'parameters': [],
+                'qasm_def': 'gate cx c,t { CX c,t; }'
+            },
+            {
+                'name': 'id',
+                'parameters': [],
+                'qasm_def': 'gate id a { U(0,0,0) a; }'
+            },
+            {
+                'name': 'h',
+                'parameters': [],
+                'qasm_def': 'gate h a { u2(0,pi) a; }'
+            },
+            {
+                'name': 's',
+                'parameters': [],
+                'qasm_def': 'gate s a { u1(pi/2) a; }'
+            },
+            {
+                'name': 't',
+                'parameters': [],
+                'qasm_def': 'gate t a { u1(pi/4) a; }'
+            }
+        ]
+    }
+
+    def __init__(self, configuration=None, provider=None):
+        """
+        Args:
+            configuration (BackendConfiguration): backend configuration
+            provider (ProjectQProvider): parent provider
+        Raises:
+             ImportError: if the Project Q simulator is not available.
+        """
+        super().__init__(configuration=(configuration or
+                                        BackendConfiguration.from_dict(self.DEFAULT_CONFIGURATION)),
+                         provider=provider)
+        self._observables = []
+
+    def _run_experiments(self, job_id, qobj, experiments, shard):
+        """Run circuits in qobj on this backend.
+
+            Args:
+                qobj (Qobj): Qobj structure
+                job_id (str): A job id
+                experiments (list[int]): indices of the experiments to run,
+                    or None for all of them
+                shard (tuple): always None, experiments are not sharded
+
+            Returns:
+                dict: the dictionary form of the ``Result``.
+
+            Raises:
+                ProjectQSimulatorError: if an observable is not valid.
+        """
+        self._observables = [_observable_terms(observable) for observable in
+                             getattr(qobj.config, 'observables', None) or []]
+        return super()._run_experiments(job_id, qobj, experiments, shard)
+
+    def run_circuit(self, circuit, seed=None):
+        """Run a circuit once and return the exact outcome probabilities.
+
+        Args:
+            circuit (QobjExperiment): Qobj experiment
+            seed (int): unused, the probabilities do not depend on a seed
+
+        Returns:
+            dict: A dictionary of results which looks something like:
+
+                {
+                "data":
+                    {
+                    "probabilities": {'0x0': 0.5, '0x3': 0.5},
+                    "expectation_values": [1.0],
+                    },
+                "status": --status (string)--
+                }
+
+        Raises:
+            ProjectQSimulatorError: if an observable acts on a qubit the
+                circuit does not have.
+        """
+        # pylint: disable=unused-argument
+        self._number_of_qubits = circuit.config.n_qubits
+        self._number_of_clbits = circuit.config.memory_slots
+        self._shots = 1
+        start = time.time()
+        simulator = CppSimulator(self._number_of_qubits, 0, self._dtype)
+        program = fuse_gates(compile_circuit(circuit, self._configuration.backend_name),
+                             self._fusion_width)
+
+        # The measurements are all terminal: simulate the gates only, and
+        # read the distribution of the measured qubits off the final state.
+        snapshots = self._open_snapshots()
+        try:
+            self._run_program(simulator, [operation for operation in program
+                                          if operation.kind != MEASURE], snapshots)
+            measurements = [(operation.targets[0], operation.clbit) for operation in program
+                            if operation.kind == MEASURE]
+            data = {'probabilities': _probabilities(simulator.statevector(), measurements,
+                                                    self._number_of_clbits)}
+
+            if self._observables:
+                expectation_values = []
+                for terms in self._observables:
+                    for term, _ in terms:
+                        if any(qubit >= self._number_of_qubits for qubit, _ in term):
+                            raise ProjectQSimulatorError(
+                                'In circuit {}: observable acts on qubits the circuit does '
+                                'not have.'.format(circuit.header.name))
+                    expectation_values.append(simulator.expectation_value(terms))
+                data['expectation_values'] = expectation_values
+            snapshots = _close_snapshots(snapshots)
+        except BaseException:
+            _discard_snapshots(snapshots)
+            raise
+
+        if snapshots != {}:
+            data['snapshots'] = snapshots
+        end = time.time()
+        return self._experiment_result(circuit, data, end - start)
+
+    def _sweep_circuit(self, circuit, program, slots, parameters):
+        """Compute the exact probabilities for every binding of the parameters.
+
+        Args:
+            circuit (QobjExperiment): Qobj experiment of the template
+            program (list[CompiledOperation]): the compiled template
+            slots (list[tuple]): its parametrized gates
+            parameters (numpy.ndarray): the bindings, one per row
+
+        Returns:
+            numpy.ndarray: the probability of every classical state for every
+                binding, of shape ``(bindings, 2**memory_slots)``.
+        """
+        self._number_of_qubits = circuit.config.n_qubits
+        self._number_of_clbits = circuit.config.memory_slots
+        simulator = CppSimulator(self._number_of_qubits, 0, self._dtype)
+        measurements = [(operation.targets[0], operation.clbit) for operation in program
+                        if operation.kind == MEASURE]
+        classical_states = _classical_states(1 << self._number_of_qubits, measurements,
+                                             self._number_of_clbits)
+        probabilities = np.zeros((len(parameters), 1 << self._number_of_clbits))
+        for index, values in enumerate(parameters.tolist()):
+            if index > 0:
+                simulator.reset()
+            bound = bind_parameters(program, slots, values, self._configuration.backend_name)
+            self._run_program(simulator, fuse_gates([operation for operation in bound
+                                                     if operation.kind != MEASURE],
+                                                    self._fusion_width), {})
+            probabilities[index] = np.bincount(classical_states,
+                                               weights=_squared_norms(simulator.statevector()),
+                                               minlength=1 << self._number_of_clbits)
+        return probabilities
+
+    def _shard_count(self, qobj, circuit):
+        """The probabilities of an experiment are computed once: never shard it.
+
+        Args:
+            qobj (Qobj): Qobj structure
+            circuit (QobjExperiment): Qobj experiment
+
+        Returns:
+            int: always 1.
+        """
+        return 1
+
+    def _footprint(self, qobj, circuit, shard):
+        """Estimate the memory of an experiment.
+
+        Args:
+            qobj (Qobj): Qobj structure
+            circuit (QobjExperiment): Qobj experiment
+            shard (tuple): always None, experiments are not sharded
+
+        Returns:
+            Footprint: the working and retained bytes of the experiment.
+        """
+        n_qubits = circuit.config.n_qubits
+        dtype = precision_dtype(getattr(qobj.config, 'precision', None))
+        outcomes = 1 << min(n_qubits, circuit.config.memory_slots)
+        snapshots = 0
+        if getattr(qobj.config, 'snapshot_directory', None) is None:
+            snapshots = count_snapshots(circuit)
+        return Footprint(simulation_bytes(n_qubits, dtype) +
+                         (_OUTCOME_MAPPING_BYTES_PER_AMPLITUDE << n_qubits),
+                         snapshots * statevector_bytes(n_qubits, dtype) +
+                         outcomes * _PROBABILITY_ENTRY_BYTES)
+
+    def _cacheable(self, qobj, circuit):
+        """The probabilities of an experiment do not depend on a seed.
+
+        Args:
+            qobj (Qobj): Qobj structure
+            circuit (QobjExperiment): Qobj experiment
+
+        Returns:
+            bool: True, unless its snapshots are written to files.
+        """
+        return getattr(qobj.config, 'snapshot_directory', None) is None
+
+    def _validate(self, qobj):
+        """Semantic validations of the qobj which cannot be done via schemas.
+
+        Args:
+            qobj (Qobj): Qobj structure.
+
+        Raises:
+            ProjectQSimulatorError: if a circuit resets qubits, has conditional
+                operations, or applies gates after a measurement.
+        """
+        for circuit in qobj.experiments:
+            measured = False
+            for operation in circuit.instructions:
+                if operation.name == 'reset' or hasattr(operation, 'conditional'):
+                    raise ProjectQSimulatorError(
+                        "In circuit {}: probability simulator does not support reset or "
+                        "conditional operations.".format(circuit.header.name))
+                if operation.name == 'measure':
+                    measured = True
+                elif measured and operation.name not in ('id', 'u0', 'barrier'):
+                    raise ProjectQSimulatorError(
+                        "In circuit {}: probability simulator only supports measurements "
+                        "at the end of the circuit.".format(circuit.header.name))
+
+
+def _observable_terms(observable):
+    """Convert an observable into the terms expected by the C++ simulator.
+
+    Args:
+        observable (QubitOperator or str): the observable, as a
+            ``QubitOperator`` or as a string accepted by its constructor
+
+    Returns:
+        list: ``(term, coefficient)`` pairs, with real coefficients.
+
+    Raises:
+        ProjectQSimulatorError: if the observable is not Hermitian.
+    """
+    if isinstance(observable, str):
+        observable = QubitOperator(observable)
+    terms = []
+    for term, coefficient in observable.terms.items():
+        coefficient = complex(coefficient)
+        if abs(coefficient.imag) > 1e-12:
+            raise ProjectQSimulatorError(
+                'Observable {} has a complex coefficient: it is not '
+                'Hermitian.'.format(observable))
+        terms.append((list(term), coefficient.real))
+    return terms
+
+
+def _probabilities(statevector, measurements, number_of_clbits):
+    """Exact distribution of the classical state after the measurements.
+
+    Args:
+        statevector (numpy.ndarray): the state before the measurements
+        measurements (list): (qubit, clbit) pairs, in circuit order
+        number_of_clbits (int): number of memory slots of the circuit
+
+    Returns:
+        dict: the probability of every possible classical state, with the
+            same hexadecimal keys as counts, e.g. {'0x0': 0.5, '0x3': 0.5}.
+    """
+    classical_states = _classical_states(len(statevector), measurements, number_of_clbits)
+    values, inverse = np.unique(classical_states, return_inverse=True)
+    probabilities = np.bincount(inverse, weights=_squared_norms(statevector))
+    return {hex(int(value)): probability
+            for value, probability in zip(values.tolist(), probabilities.tolist())
+            if probability > 0}
+
+
+def _squared_norms(statevector):
+    """Return the probability of each basis state, in double precision.
+
+    Args:
+        statevector (numpy.ndarray): complex64 or complex128 statevector
+
+    Returns:
+        numpy.ndarray: the squared norms of the amplitudes, as float64.
+    """
+    return np.abs(statevector).astype(np.float64) ** 2
+
+
+def _classical_states(dimension, measurements, number_of_clbits):
+    """Classical state measured from each basis state.
+
+    Args:
+        dimension (int): number of basis states
+        measurements (list): (qubit, clbit) pairs, in circuit order
+        number_of_clbits (int): number of memory slots of the circuit
+
+    Returns:
+        numpy.ndarray: the classical state of each basis state.
+    """
+    # Python integers are only needed when the shifts overflow int64.
+    dtype = np.int64 if number_of_clbits <= 62 else object
+    basis_states = np.arange(dimension, dtype=np.int64)
+    classical_states = np.zeros(dimension, dtype=dtype)
+    for qubit, clbit in measurements:
+        bits = ((basis_states >> qubit) & 1).astype(dtype)
+        classical_states = (classical_states & ~(1 << clbit)) | (bits << clbit)
+    return classical_states
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018, IBM.
+#
+# This source code is licensed under the Apache License, Version 2.0 found in
+# the LICENSE.txt file in the root directory of this source tree.
+
+"""
+Caches addressed by the content of the experiments.
+
+An experiment whose outcome is fully determined by its qobj, because it is
+seeded or does not sample at all, always gives the same result. Its result
+is stored under a hash of everything it depends on, and resubmitting the
+same experiment returns the stored result instead of simulating it again.
+
+Final statevectors are also kept, under a hash of the instructions leading
+to them, so that an experiment extending another one can resume from its
+final state.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache(object):
+    """LRU cache of experiment results, with an optional on-disk store.
+
+    Attributes:
+        max_entries (int): maximum number of results kept in memory
+        directory (str): directory of the on-disk store, or None
+        max_disk_bytes (int): maximum size of the on-disk store, or None for
+            no limit
+        hits (int): number of results found in the cache
+        misses (int): number of results looked up but not found
+    """
+
+    def __init__(self, max_entries=128, directory=None, max_disk_bytes=None):
+        """
+        Args:
+            max_entries (int): maximum number of results kept in memory
+            directory (str): directory where results are also stored, so that
+                they outlive the process, or None to only keep them in memory
+            max_disk_bytes (int): maximum number of bytes of the on-disk
+                store, the least recently used results being removed first
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        """Look a result up.
+
+        Args:
+            key (str): the key of the experiment, from ``experiment_key``
+
+        Returns:
+            dict: the experiment result, or None if it is not in the cache.
+        """
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+        if result is None and self.directory is not None:
+            result = self._load(key)
+            if result is not None:
+                self._remember(key, result)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def put(self, key, result):
+        """Store a result.
+
+        Args:
+            key (str): the key of the experiment, from ``experiment_key``
+            result (dict): the experiment result
+        """
+        self._remember(key, result)
+        if self.directory is not None:
+            self._store(key, result)
+
+    def clear(self):
+        """Remove all the results, from memory and from disk."""
+        with self._lock:
+            self._entries.clear()
+        if self.directory is not None:
+            for path, _, _ in self._disk_entries():
+                _remove(path)
+
+    def _remember(self, key, result):
+        """Keep a result in memory, evicting the least recently used ones.
+
+        Args:
+            key (str): the key of the experiment
+            result (dict): the experiment result
+        """
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _path(self, key):
+        """Path of the stored result of an experiment."""
+        return os.path.join(self.directory, key + '.pickle')
+
+    def _load(self, key):
+        """Read a result from the on-disk store.
+
+        Args:
+            key (str): the key of the experiment
+
+        Returns:
+            dict: the experiment result, or None if it is not stored.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                result = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception:  # pylint: disable=broad-except
+            logger.warning('could not read cached result %s', path)
+            _remove(path)
+            return None
+        # The modification time orders the stored results by last use.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def _store(self, key, result):
+        """Write a result to the on-disk store and enforce its size limit.
+
+        Args:
+            key (str): the key of the experiment
+            result (dict): the experiment result
+        """
+        handle, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, self._path(key))
+        except Exception:  # pylint: disable=broad-except
+            logger.warning('could not store cached result %s', key)
+            _remove(temporary_path)
+            return
+
+        if self.max_disk_bytes is not None:
+            entries = sorted(self._disk_entries(), key=lambda entry: entry[1])
+            total = sum(size for _, _, size in entries)
+            for path, _, size in entries:
+                if total <= self.max_disk_bytes:
+                    break
+                _remove(path)
+                total -= size
+
+    def _disk_entries(self):
+        """List the stored results.
+
+        Returns:
+            list[tuple]: ``(path, modification time, size)`` of each file.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+
+class StatevectorCache(object):
+    """LRU cache of statevectors, bounded by their total size.
+
+    Attributes:
+        max_bytes (int): maximum number of bytes of the cached statevectors,
+            0 to disable the cache
+    """
+
+    def __init__(self, max_bytes=0):
+        """
+        Args:
+            max_bytes (int): maximum number of bytes of the cached
+                statevectors
+        """
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Look a statevector up.
+
+        Args:
+            key (str): the key of the instructions leading to the state
+
+        Returns:
+            numpy.ndarray: the read-only statevector, or None.
+        """
+        with self._lock:
+            statevector = self._entries.get(key)
+            if statevector is not None:
+                self._entries.move_to_end(key)
+            return statevector
+
+    def put(self, key, statevector):
+        """Store a statevector, evicting the least recently used ones.
+
+        The statevector is made read-only, since it is shared with the
+        result it was stored from.
+
+        Args:
+            key (str): the key of the instructions leading to the state
+            statevector (numpy.ndarray): the statevector
+        """
+        if statevector.nbytes > self.max_bytes:
+            return
+        statevector.flags.writeable = False
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = statevector
+            self._bytes += statevector.nbytes
+            self._shrink()
+
+    def _shrink(self):
+        """Evict the least recently used statevectors over the size limit."""
+        while self._bytes > self.max_bytes:
+            _, statevector = self._entries.popitem(last=False)
+            self._bytes -= statevector.nbytes
+
+
+def instruction_prefix_keys(circuit):
+    """Hash every prefix of the instructions of an experiment.
+
+    The prefixes stop at the first snapshot: resuming past it from a cached
+    state would skip it.
+
+    Args:
+        circuit (QobjExperiment): Qobj experiment
+
+    Returns:
+        list[str]: the key of the first ``i`` instructions at index ``i``.
+    """
+    digest = hashlib.sha256(str(circuit.config.n_qubits).encode('utf-8'))
+    keys = [digest.hexdigest()]
+    for operation in circuit.instructions:
+        if operation.name == 'snapshot':
+            break
+        digest.update(json.dumps(operation.as_dict(), sort_keys=True,
+                                 separators=(',', ':'), default=str).encode('utf-8'))
+        keys.append(digest.hexdigest())
+    return keys
+
+
+def experiment_key(backend, qobj, index):
+    """Hash everything the result of an experiment depends on.
+
+    Args:
+        backend (BaseBackend): the backend running the experiment
+        qobj (Qobj): the qobj of the experiment
+        index (int): the index of the experiment in the qobj, from which its
+            default seed is derived
+
+    Returns:
+        str: the hexadecimal SHA-256 digest identifying the experiment.
+    """
+    content = {'backend': backend.name(),
+               'backend_version': backend.configuration().backend_version,
+               'config': qobj.config.as_dict(),
+               'experiment': qobj.experiments[index].as_dict(),
+               'index': index}
+    canonical = json.dumps(content, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _remove(path):
+    """Remove a file, if it still exists."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018, IBM.
+#
+# This source code is licensed under the Apache License, Version 2.0 found in
+# the LICENSE.txt file in the root directory of this source tree.
+
+"""
+Compilation of Qobj experiments into flat programs for the ProjectQ simulators.
+
+The instructions of a QobjExperiment are translated once per experiment into
+a list of ``CompiledOperation``, where the qubits are already resolved to the
+ids of the C++ simulator (qubit ``i`` of the experiment has id ``i``), the
+gates are already built as the matrices applied by the simulator, and the
+conditionals are already parsed into integers. The shot loop of the
+simulators then only has to execute that list.
+
+Before that, consecutive gates can be fused into single unitaries by
+``fuse_gates``, so that fewer of them go through the simulator.
+"""
+
+import cmath
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from .projectqsimulatorerror import ProjectQSimulatorError
+
+# Kinds of compiled operations.
+GATE = 0
+MEASURE = 1
+SNAPSHOT = 2
+RESET = 3
+
+CompiledOperation = namedtuple('CompiledOperation',
+                               ['kind', 'matrix', 'targets', 'controls', 'clbit', 'label',
+                                'conditional'])
+CompiledOperation.__doc__ = """A single step of a compiled program.
+
+Attributes:
+    kind (int): one of ``GATE``, ``MEASURE``, ``SNAPSHOT`` or ``RESET``.
+    matrix (list): the matrix of a ``GATE`` operation, as nested lists.
+    targets (list[int]): the ids of the qubits the operation acts on.
+    controls (list[int]): the ids of the control qubits of a ``GATE``.
+    clbit (int): the memory slot written by a ``MEASURE`` operation.
+    label (str): the location of a ``SNAPSHOT`` operation.
+    conditional (tuple): ``(mask, shift, value)`` integers, meaning that the
+        operation only runs if ``(classical_state & mask) >> shift == value``,
+        or None if the operation is unconditional.
+"""
+
+X_MATRIX = [[0j, 1 + 0j], [1 + 0j, 0j]]
+
+# Widest gates built by fuse_gates: 0 disables fusion, 1 only fuses the
+# single-qubit gates and 2 also folds them into 2-qubit blocks around cx.
+DEFAULT_FUSION_WIDTH = 2
+
+# Number of angles of the parametrized gates.
+PARAMETER_COUNTS = {'U': 3, 'u3': 3, 'u2': 2, 'u1': 1}
+
+
+def compile_circuit(circuit, backend_name, start=0):
+    """Compile the instructions of an experiment into a flat program.
+
+    Resets of qubits that are known to be in the ground state, because no
+    gate acted on them since the start of the circuit or since their last
+    reset, are left out of the program.
+
+    Args:
+        circuit (QobjExperiment): Qobj experiment
+        backend_name (str): name of the backend, used in error messages
+        start (int): index of the first instruction to compile, when the
+            state after the previous ones is already known
+
+    Returns:
+        list[CompiledOperation]: the program, in execution order.
+
+    Raises:
+        ProjectQSimulatorError: if an instruction is not supported.
+    """
+    return compile_template(circuit, backend_name, start)[0]
+
+
+def compile_template(circuit, backend_name, start=0):
+    """Compile an experiment whose gate angles are to be bound later.
+
+    The angles of the u1, u2 and u3 gates of the experiment are its
+    parameters, in instruction order. The program is compiled with the
+    angles of the experiment, and ``bind_parameters`` then only rebuilds the
+    matrices of these gates for other values of the parameters.
+
+    Args:
+        circuit (QobjExperiment): Qobj experiment
+        backend_name (str): name of the backend, used in error messages
+        start (int): index of the first instruction to compile
+
+    Returns:
+        tuple: the program, as a list of ``CompiledOperation`` in execution
+            order, and the ``(index, name, offset)`` of each parametrized
+            gate, where ``index`` is its position in the program and
+            ``offset`` the position of its first angle in the parameters.
+
+    Raises:
+        ProjectQSimulatorError: if an instruction is not supported.
+    """
+    program = []
+    slots = []
+    n_parameters = 0
+    # Past the first instructions, the state of the qubits is unknown.
+    ground_qubits = set(range(circuit.config.n_qubits)) if start == 0 else set()
+    for operation in circuit.instructions[start:]:
+        conditional = _compile_conditional(operation)
+        name = operation.name
+        if name in ('id', 'u0', 'barrier'):
+            continue
+        elif name in ('measure', 'snapshot'):
+            if name == 'measure':
+                program.append(CompiledOperation(MEASURE, None, [operation.qubits[0]], None,
+                                                 operation.memory[0], None, conditional))
+            else:
+                program.append(CompiledOperation(SNAPSHOT, None, None, None, None,
+                                                 str(operation.params[0]), conditional))
+        elif name == 'reset':
+            qubit = operation.qubits[0]
+            if qubit in ground_qubits:
+                continue
+            program.append(CompiledOperation(RESET, None, [qubit], None, None, None,
+                                             conditional))
+            if conditional is None:
+                ground_qubits.add(qubit)
+        else:
+            if name in ('CX', 'cx'):
+                gate = CompiledOperation(GATE, X_MATRIX, [operation.qubits[1]],
+                                         [operation.qubits[0]], None, None, conditional)
+            else:
+                params = getattr(operation, 'params', None)
+                gate = CompiledOperation(GATE, _gate_matrix(name, params, backend_name),
+                                         [operation.qubits[0]], [], None, None, conditional)
+                if name in PARAMETER_COUNTS:
+                    slots.append((len(program), name, n_parameters))
+                    n_parameters += PARAMETER_COUNTS[name]
+            # A gate controlled by a qubit in the ground state does nothing.
+            if ground_qubits.isdisjoint(gate.controls):
+                ground_qubits.difference_update(gate.targets)
+            program.append(gate)
+    return program, slots
+
+
+def bind_parameters(program, slots, parameters, backend_name):
+    """Return a copy of a compiled template with other gate angles.
+
+    Args:
+        program (list[CompiledOperation]): the program of the template
+        slots (list[tuple]): its parametrized gates, from ``compile_template``
+        parameters (sequence[float]): the angles of all the parametrized gates
+        backend_name (str): name of the backend, used in error messages
+
+    Returns:
+        list[CompiledOperation]: the program with the given angles.
+    """
+    program = list(program)
+    for index, name, offset in slots:
+        params = parameters[offset:offset + PARAMETER_COUNTS[name]]
+        program[index] = program[index]._replace(
+            matrix=_gate_matrix(name, params, backend_name))
+    return program
+
+
+def count_parameters(slots):
+    """Return the number of parameters of a compiled template.
+
+    Args:
+        slots (list[tuple]): its parametrized gates, from ``compile_template``
+
+    Returns:
+        int: the number of angles to bind.
+    """
+    return sum(PARAMETER_COUNTS[name] for _, name, _ in slots)
+
+
+def u3_matrix(theta, phi, lam):
+    """Return the matrix of the u3 gate.
+
+    Args:
+        theta (float): the theta angle
+        phi (float): the phi angle
+        lam (float): the lambda angle
+
+    Returns:
+        list: the 2x2 unitary, as nested lists of complex numbers.
+    """
+    cos = math.cos(theta / 2)
+    sin = math.sin(theta / 2)
+    return [[complex(cos), -cmath.exp(1j * lam) * sin],
+            [cmath.exp(1j * phi) * sin, cmath.exp(1j * (phi + lam)) * cos]]
+
+
+def _phase_matrix(lam):
+    """Return the matrix of the u1 gate.
+
+    Args:
+        lam (float): the lambda angle
+
+    Returns:
+        list: the 2x2 unitary, as nested lists of complex numbers.
+    """
+    return [[1 + 0j, 0j], [0j, cmath.exp(1j * lam)]]
+
+
+def _gate_matrix(name, params, backend_name):
+    """Return the matrix of a single-qubit gate.
+
+    Args:
+        name (str): the name of the gate
+        params (sequence[float]): the angles of the gate, if any
+        backend_name (str): name of the backend, used in error messages
+
+    Returns:
+        list: the 2x2 unitary, as nested lists of complex numbers.
+
+    Raises:
+        ProjectQSimulatorError: if the gate is not supported.
+    """
+    if name in ('U', 'u3'):
+        return u3_matrix(params[0], params[1], params[2])
+    elif name == 'u2':
+        return u3_matrix(math.pi / 2, params[0], params[1])
+    elif name == 'u1':
+        return _phase_matrix(params[0])
+    elif name == 't':
+        return _phase_matrix(math.pi / 4)
+    elif name == 'h':
+        return u3_matrix(math.pi / 2, 0, math.pi)
+    elif name == 's':
+        return _phase_matrix(math.pi / 2)
+
+    err_msg = '{0} encountered unrecognized operation "{1}"'
+    raise ProjectQSimulatorError(err_msg.format(backend_name, name))
+
+
+def fuse_gates(program, fusion_width=DEFAULT_FUSION_WIDTH):
+    """Merge consecutive gates of a compiled program into fewer unitaries.
+
+    Consecutive single-qubit gates on the same qubit are multiplied into a
+    single 2x2 unitary. With a fusion width of 2, the cx gates and the
+    single-qubit gates around them are also folded into 4x4 unitaries on
+    pairs of qubits. Gates are only moved past operations on other qubits,
+    and never past a measurement, a snapshot or a conditional operation, so
+    the fused program has the same deterministic prefix and the same
+    terminal measurements as the original one.
+
+    Args:
+        program (list[CompiledOperation]): the compiled program
+        fusion_width (int): number of qubits of the widest fused gates, 0
+            to leave the program unchanged
+
+    Returns:
+        list[CompiledOperation]: the fused program.
+
+    Raises:
+        ProjectQSimulatorError: if the fusion width is not 0, 1 or 2.
+    """
+    if fusion_width not in (0, 1, 2):
+        raise ProjectQSimulatorError(
+            'Invalid fusion width {}: expected 0, 1 or 2.'.format(fusion_width))
+    if fusion_width == 0:
+        return list(program)
+
+    fused = []
+    open_blocks = []
+
+    def flush(qubits=None):
+        """Emit the open blocks acting on some qubits, or all of them."""
+        for block in list(open_blocks):
+            if qubits is None or not qubits.isdisjoint(block.qubits):
+                fused.append(block.operation())
+                open_blocks.remove(block)
+
+    for operation in program:
+        if operation.kind != GATE or operation.conditional is not None:
+            flush()
+            fused.append(operation)
+            continue
+
+        qubits = operation.targets + operation.controls
+        blocks = [block for block in open_blocks if not block.qubits.isdisjoint(qubits)]
+        if len(qubits) > fusion_width:
+            flush(set(qubits))
+            fused.append(operation)
+        elif len(blocks) == 1 and blocks[0].qubits.issuperset(qubits):
+            blocks[0].apply(operation)
+        else:
+            # Blocks reaching out of the qubits of the gate are emitted, the
+            # others are merged into a new block on these qubits.
+            flush(set(qubit for block in blocks if not block.qubits.issubset(qubits)
+                      for qubit in block.qubits))
+            block = _FusedBlock(qubits)
+            for merged in [merged for merged in open_blocks
+                           if not merged.qubits.isdisjoint(qubits)]:
+                block.merge(merged)
+                open_blocks.remove(merged)
+            block.apply(operation)
+            open_blocks.append(block)
+    flush()
+    return fused
+
+
+class _FusedBlock(object):
+    """Gates fused into a single unitary on one or two qubits."""
+
+    def __init__(self, qubits):
+        """
+        Args:
+            qubits (list[int]): ids of the qubits of the block, the first
+                one being the least significant bit of the matrix indices
+        """
+        self.ordered_qubits = list(qubits)
+        self.qubits = frozenset(qubits)
+        self.matrix = np.identity(1 << len(qubits), dtype=complex)
+        self.operations = []
+
+    def apply(self, operation):
+        """Append a gate to the block.
+
+        Args:
+            operation (CompiledOperation): a gate on qubits of the block
+        """
+        self.matrix = _block_matrix(operation.matrix, operation.targets[0],
+                                    operation.controls, self.ordered_qubits).dot(self.matrix)
+        self.operations.append(operation)
+
+    def merge(self, block):
+        """Append a single-qubit block to the block.
+
+        Args:
+            block (_FusedBlock): a block on one of the qubits of this block
+        """
+        self.matrix = _block_matrix(block.matrix, block.ordered_qubits[0], [],
+                                    self.ordered_qubits).dot(self.matrix)
+        self.operations.extend(block.operations)
+
+    def operation(self):
+        """Return the fused gate.
+
+        Returns:
+            CompiledOperation: the single gate of the block, as it was, or the
+                product of all of them.
+        """
+        if len(self.operations) == 1:
+            return self.operations[0]
+        return CompiledOperation(GATE, self.matrix.tolist(), self.ordered_qubits, [],
+                                 None, None, None)
+
+
+def _block_matrix(matrix, target, controls, qubits):
+    """Extend the matrix of a (controlled) single-qubit gate to a block.
+
+    Args:
+        matrix (list): the 2x2 matrix of the gate
+        target (int): id of the target qubit
+        controls (list[int]): ids of the control qubits
+        qubits (list[int]): ids of the qubits of the block, the first one
+            being the least significant bit of the matrix indices
+
+    Returns:
+        numpy.ndarray: the unitary of the gate on the qubits of the block.
+    """
+    target_bit = qubits.index(target)
+    control_mask = sum(1 << qubits.index(control) for control in controls)
+    dimension = 1 << len(qubits)
+    block = np.zeros((dimension, dimension), dtype=complex)
+    for column in range(dimension):
+        if column & control_mask != control_mask:
+            block[column, column] = 1
+            continue
+        value = (column >> target_bit) & 1
+        for row_value in (0, 1):
+            row = (column & ~(1 << target_bit)) | (row_value << target_bit)
+            block[row, column] = matrix[row_value][value]
+    return block
+
+
+def _compile_conditional(operation):
+    """Parse the conditional of an instruction into integers.
+
+    Args:
+        operation (QobjInstruction): the instruction
+
+    Returns:
+        tuple: ``(mask, shift, value)``, or None if the instruction is not
+            conditional.
+    """
+    if not hasattr(operation, 'conditional'):
+        return None
+    mask = int(operation.conditional.mask, 16)
+    if mask == 0:
+        return None
+    shift = (mask & -mask).bit_length() - 1
+    return mask, shift, int(operation.conditional.val, 16)
+
+
+def is_sampleable(program, number_of_clbits):
+    """Check whether the shots of a program can be sampled from a single run.
+
+    This is the case when no gate follows a measurement or a reset, and
+    there are no conditionals or snapshots whose outcome depends on the shot.
+    Resets among the final measurements do not change the distribution of
+    the other qubits, and a reset qubit is then always measured as 0.
+
+    Args:
+        program (list[CompiledOperation]): the compiled program
+        number_of_clbits (int): number of memory slots of the circuit
+
+    Returns:
+        bool: True if all the measurements are terminal.
+    """
+    if number_of_clbits > 62:
+        return False
+    measured = False
+    for operation in program:
+        if operation.conditional is not None or operation.kind == SNAPSHOT:
+            return False
+        if operation.kind in (MEASURE, RESET):
+            measured = True
+        elif measured:
+            return False
+    return True
+
+
+def is_sampleable_experiment(circuit):
+    """Check, before compiling it, whether an experiment can be sampled.
+
+    This is the counterpart of ``is_sampleable`` on the Qobj instructions,
+    for callers that need to know it before running the experiment. Resets
+    are all assumed to be kept, so it may answer False for programs that
+    ``is_sampleable`` accepts.
+
+    Args:
+        circuit (QobjExperiment): Qobj experiment
+
+    Returns:
+        bool: True if all the measurements are terminal.
+    """
+    if circuit.config.memory_slots > 62:
+        return False
+    measured = False
+    for operation in circuit.instructions:
+        if _compile_conditional(operation) is not None:
+            return False
+        if operation.name == 'snapshot':
+            return False
+        if operation.name in ('measure', 'reset'):
+            measured = True
+        elif measured and operation.name not in ('id', 'u0', 'barrier'):
+            return False
+    return True
+
+
+def deterministic_prefix_length(program):
+    """Length of the longest prefix of a program that is the same every shot.
+
+    The prefix stops at the first measurement, reset, snapshot or
+    conditional operation.
+
+    Args:
+        program (list[CompiledOperation]): the compiled program
+
+    Returns:
+        int: number of leading operations that are unconditional gates.
+    """
+    for index, operation in enumerate(program):
+        if operation.kind != GATE or operation.conditional is not None:
+            return index
+    return len(program)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018, IBM.
+#
+# This source code is licensed under the Apache License, Version 2.0 found in
+# the LICENSE.txt file in the root directory of this source tree.
+
+"""
+Direct access to the ProjectQ C++ simulator.
+
+Qobj experiments are already expressed in the basis of the simulators, so
+the ProjectQ ``MainEngine`` and its Python ``Simulator`` backend are
+bypassed: compiled gates are handed straight to the C++ simulator as
+matrices, and the qubit ids are managed here.
+
+With no engine list left to build, a new C++ simulator only costs the
+allocation of its qubits, which is cheaper than loading the ground state into
+a used one: each experiment gets its own simulator instead of one from a
+pool, and ``reset`` replaces the C++ simulator as well.
+"""
+
+import numpy as np
+
+from .projectqcompiler import X_MATRIX
+try:
+    from projectq.backends._sim._cppsim import Simulator as CppSim
+except ImportError:
+    CppSim = None
+
+
+class CppSimulator(object):
+    """The qubits of one experiment, held by a ProjectQ C++ simulator.
+
+    Qubit ``i`` of the experiment is allocated with id ``i``, in order, so
+    that it is also bit ``i`` of the index of the statevector.
+
+    The C++ simulator always computes in double precision: the precision of
+    the simulator is the one of the statevectors copied out of it, and of
+    the states loaded into it.
+
+    Attributes:
+        number_of_qubits (int): number of allocated qubits
+        dtype (numpy.dtype): complex64 or complex128, the precision of the
+            statevectors on the Python side
+        apply_controlled_gate (callable): ``(matrix, targets, controls)``,
+            applies a gate given as nested lists to the qubit ids
+        measure_qubits (callable): ``(ids)``, measures qubits and returns
+            their values as a list of bools
+    """
+
+    def __init__(self, number_of_qubits, seed, dtype=complex):
+        """
+        Args:
+            number_of_qubits (int): number of qubits to allocate
+            seed (int): seed of the random number generator
+            dtype (numpy.dtype): complex64 or complex128
+        """
+        self.number_of_qubits = number_of_qubits
+        self.dtype = np.dtype(dtype)
+        self._seed = seed
+        self._ids = list(range(number_of_qubits))
+        self._allocate(seed)
+
+    def _allocate(self, seed):
+        """Allocate the qubits in the ground state of a new C++ simulator.
+
+        Args:
+            seed (int): seed of its random number generator
+        """
+        self._simulator = CppSim(seed)
+        for qubit in self._ids:
+            self._simulator.allocate_qubit(qubit)
+        # Bound once, these are called for every operation of every shot.
+        self.apply_controlled_gate = self._simulator.apply_controlled_gate
+        self.measure_qubits = self._simulator.measure_qubits
+
+    def statevector(self):
+        """Return a copy of the current statevector.
+
+        Returns:
+            numpy.ndarray: the complex amplitudes, indexed by qubit id bits.
+        """
+        self._simulator.run()
+        return np.array(self._simulator.cheat()[1], dtype=self.dtype)
+
+    def set_statevector(self, statevector):
+        """Replace the current state.
+
+        Args:
+            statevector (numpy.ndarray): the complex amplitudes, indexed by
+                qubit id bits
+        """
+        self._simulator.run()
+        self._simulator.set_wavefunction(statevector, self._ids)
+
+    def reset(self, seed=None):
+        """Bring the qubits back to the ground state, whatever their state.
+
+        Loading a ground state goes through ``set_wavefunction``, which copies
+        it amplitude by amplitude, and takes longer than allocating the qubits
+        of a new C++ simulator: the C++ simulator is replaced instead.
+
+        Args:
+            seed (int): seed of the random number generator from now on,
+                defaults to the seed the simulator was created with
+        """
+        self._allocate(self._seed if seed is None else seed)
+
+    def expectation_value(self, terms):
+        """Return the exact expectation value of an observable.
+
+        Args:
+            terms (list): ``(term, coefficient)`` pairs of the observable,
+                each term being a list of ``(qubit, 'X' | 'Y' | 'Z')`` pairs
+                and each coefficient a real number
+
+        Returns:
+            float: the expectation value in the current state.
+        """
+        self._simulator.run()
+        return self._simulator.get_expectation_value(terms, self._ids)
+
+    def collapse(self):
+        """Collapse all the qubits onto a basis state in a single pass.
+
+        Returns:
+            list[bool]: the value each qubit collapsed to.
+        """
+        return self._simulator.measure_qubits(self._ids)
+
+    def reset_to_ground(self, bits):
+        """Bring a collapsed state back to the ground state.
+
+        The basis state the qubits collapsed to may carry a global phase,
+        left by the gates applied before the collapse: it is removed as well,
+        so that the ground state is exactly the one of a new simulator.
+
+        Args:
+            bits (list[bool]): the values the qubits collapsed to
+        """
+        for qubit, bit in enumerate(bits):
+            if bit:
+                self._simulator.apply_controlled_gate(X_MATRIX, [qubit], [])
+        if self._ids:
+            self._simulator.run()
+            amplitude = self._simulator.get_amplitude([False] * len(self._ids), self._ids)
+            if amplitude != 1:
+                phase = amplitude.conjugate() / abs(amplitude)
+                self._simulator.apply_controlled_gate([[phase, 0], [0, phase]], [0], [])
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018, IBM.
+#
+# This source code is licensed under the Apache License, Version 2.0 found in
+# the LICENSE.txt file in the root directory of this source tree.
+
+"""This module implements the worker pool running ProjectQ jobs."""
+
+import collections
+import functools
+import itertools
+import logging
+import sys
+import threading
+from concurrent import futures
+
+from .projectqsimulatorerror import ProjectQSimulatorError
+
+logger = logging.getLogger(__name__)
+
+THREAD = 'thread'
+PROCESS = 'process'
+
+
+class ProjectQExecutor(object):
+    """Bounded pool of workers running ProjectQ jobs.
+
+    A job is made of one or more tasks, submitted together, which are
+    dispatched to an underlying thread or process pool. On top of it, the
+    executor bounds the number of jobs with tasks waiting or running, and
+    keeps the sum of the memory declared by the running tasks under a budget:
+    a task that does not fit waits until enough memory has been released, so
+    that large simulations do not run concurrently. A task larger than the
+    whole budget only runs when no other task is running.
+
+    Attributes:
+        max_workers (int): maximum number of tasks running at the same time
+        mode (str): 'thread' or 'process'
+        max_queue_size (int): maximum number of jobs with tasks waiting or
+            running, or None for no limit
+        memory_budget (int): maximum number of bytes used by the running
+            tasks, or None for no limit
+        reserved_memory (int): number of bytes of the budget set aside for
+            memory held between tasks, such as caches of the workers
+    """
+
+    def __init__(self, max_workers=None, mode=None, max_queue_size=None,
+                 memory_budget=None, reserved_memory=0):
+        """
+        Args:
+            max_workers (int): maximum number of workers, defaults to the
+                default of the underlying ``concurrent.futures`` pool
+            mode (str): 'thread' or 'process'. Defaults to processes on
+                Linux, and to threads on macOS and Windows.
+            max_queue_size (int): maximum number of jobs with tasks waiting
+                or running
+            memory_budget (int): maximum number of bytes used by the
+                running tasks
+            reserved_memory (int): number of bytes of the budget not
+                available to the tasks
+
+        Raises:
+            ProjectQSimulatorError: if the mode is not valid.
+        """
+        if mode is None:
+            mode = THREAD if sys.platform in ['darwin', 'win32'] else PROCESS
+        if mode == THREAD:
+            self._pool = futures.ThreadPoolExecutor(max_workers)
+        elif mode == PROCESS:
+            self._pool = futures.ProcessPoolExecutor(max_workers)
+        else:
+            raise ProjectQSimulatorError(
+                'Invalid executor mode "{}": expected "{}" or "{}".'.format(
+                    mode, THREAD, PROCESS))
+
+        self.max_workers = self._pool._max_workers
+        self.mode = mode
+        self.max_queue_size = max_queue_size
+        self.memory_budget = memory_budget
+        self.reserved_memory = reserved_memory
+
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        # Number of tasks of each job still waiting or running, by job id.
+        self._job_tasks = {}
+        self._job_ids = itertools.count()
+        self._running = 0
+        self._memory_in_use = 0
+        self._shutdown = False
+
+    @property
+    def is_process_pool(self):
+        """bool: whether the jobs run in separate processes."""
+        return self.mode == PROCESS
+
+    def submit(self, fn, *args, memory=0):
+        """Schedule a function to be run by the pool, as a job of one task.
+
+        Args:
+            fn (callable): the function to run
+            *args: arguments of the function
+            memory (int): number of bytes the task is expected to use
+
+        Returns:
+            concurrent.futures.Future: the future of the task. It stays
+                pending, and can be cancelled, until the task is dispatched.
+
+        Raises:
+            ProjectQSimulatorError: if the executor was shut down or its
+                queue is full.
+        """
+        return self.submit_job([(fn, args, memory)])[0]
+
+    def submit_job(self, tasks):
+        """Schedule the tasks of a job to be run by the pool.
+
+        The job takes a single place in the queue, whatever its number of
+        tasks, and either all of its tasks are scheduled or none is.
+
+        Args:
+            tasks (list[tuple]): ``(fn, args, memory)`` of each task: the
+                function to run, its arguments, and the number of bytes it
+                is expected to use
+
+        Returns:
+            list[concurrent.futures.Future]: the future of each task. It
+                stays pending, and can be cancelled, until the task is
+                dispatched.
+
+        Raises:
+            ProjectQSimulatorError: if the executor was shut down or its
+                queue is full.
+        """
+        task_futures = [futures.Future() for _ in tasks]
+        if not tasks:
+            return []
+        with self._lock:
+            if self._shutdown:
+                raise ProjectQSimulatorError('Cannot submit jobs after shutdown.')
+            if (self.max_queue_size is not None and
+                    len(self._job_tasks) >= self.max_queue_size):
+                raise ProjectQSimulatorError(
+                    'The job queue is full ({} jobs).'.format(self.max_queue_size))
+            job_id = next(self._job_ids)
+            self._job_tasks[job_id] = len(tasks)
+            for future, (fn, args, memory) in zip(task_futures, tasks):
+                self._pending.append((future, fn, args, memory, job_id))
+        self._dispatch()
+        return task_futures
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs, cancel the pending ones and free the workers.
+
+        Args:
+            wait (bool): whether to wait for the running jobs to finish
+        """
+        with self._lock:
+            self._shutdown = True
+            pending = list(self._pending)
+            self._pending.clear()
+            for _, _, _, _, job_id in pending:
+                self._remove_task(job_id)
+        for future, _, _, _, _ in pending:
+            future.cancel()
+        self._pool.shutdown(wait=wait)
+
+    def _fits(self, memory):
+        """Whether a task of the given size can start now.
+
+        Args:
+            memory (int): number of bytes the task is expected to use
+
+        Returns:
+            bool: True if the task fits in the memory budget.
+        """
+        if self.memory_budget is None or self._running == 0:
+            return True
+        return self._memory_in_use + memory <= self.memory_budget - self.reserved_memory
+
+    def _dispatch(self):
+        """Hand the pending tasks that fit over to the underlying pool."""
+        while True:
+            with self._lock:
+                if not self._pending or not self._fits(self._pending[0][3]):
+                    return
+                future, fn, args, memory, job_id = self._pending.popleft()
+                if not future.set_running_or_notify_cancel():
+                    self._remove_task(job_id)
+                    continue
+                self._running += 1
+                self._memory_in_use += memory
+
+            try:
+                inner = self._pool.submit(fn, *args)
+            except Exception as ex:  # pylint: disable=broad-except
+                self._release(memory, job_id)
+                future.set_exception(ex)
+                continue
+            inner.add_done_callback(functools.partial(self._finish, future, memory, job_id))
+
+    def _remove_task(self, job_id):
+        """Account for a task leaving the executor, with the lock held.
+
+        Args:
+            job_id (int): the id of the job of the task
+        """
+        self._job_tasks[job_id] -= 1
+        if self._job_tasks[job_id] == 0:
+            del self._job_tasks[job_id]
+
+    def _release(self, memory, job_id):
+        """Account for a running task leaving the executor.
+
+        Args:
+            memory (int): number of bytes the task was expected to use
+            job_id (int): the id of the job of the task
+        """
+        with self._lock:
+            self._remove_task(job_id)
+            self._running -= 1
+            self._memory_in_use -= memory
+
+    def _finish(self, future, memory, job_id, inner):
+        """Forward the outcome of a finished task and dispatch the next ones.
+
+        Args:
+            future (concurrent.futures.Future): the future returned by submit
+            memory (int): number of bytes the task was expected to use
+            job_id (int): the id of the job of the task
+            inner (concurrent.futures.Future): the future of the pool
+        """
+        self._release(memory, job_id)
+        if inner.cancelled():
+            future.set_exception(futures.CancelledError())
+        elif inner.exception() is not None:
+            future.set_exception(inner.exception())
+        else:
+            future.set_result(inner.result())
+        self._dispatch()
+
+
+_DEFAULT_EXECUTOR = None
+_DEFAULT_EXECUTOR_LOCK = threading.Lock()
+
+
+def default_executor():
+    """Return the executor shared by the backends without a ProjectQ provider.
+
+    Returns:
+        ProjectQExecutor: the default executor, created on first use.
+    """
+    global _DEFAULT_EXECUTOR  # pylint: disable=global-statement
+    with _DEFAULT_EXECUTOR_LOCK:
+        if _DEFAULT_EXECUTOR is None:
+            _DEFAULT_EXECUTOR = ProjectQExecutor()
+        return _DEFAULT_EXECUTOR
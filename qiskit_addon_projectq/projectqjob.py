@@ -9,12 +9,20 @@
 
 import functools
 import logging
-import sys
+import threading
 from concurrent import futures
 
+import numpy as np
+
 from qiskit.providers import BaseJob, JobError, JobStatus
 from qiskit.qobj import validate_qobj_against_schema
 
+from .projectqcache import experiment_key
+from .projectqexecutor import default_executor
+from .projectqplanner import check_task_memory, memory_limit, task_memory
+from .projectqresult import result_from_dict
+from .projectqtransfer import import_arrays, run_exporting_arrays
+
 logger = logging.getLogger(__name__)
 
 
@@ -31,7 +39,7 @@ def requires_submit(func):
     """
     @functools.wraps(func)
     def _wrapper(self, *args, **kwargs):
-        if self._future is None:
+        if self._futures is None:
             raise JobError("Job not submitted yet!. You have to .submit() first!")
         return func(self, *args, **kwargs)
     return _wrapper
@@ -40,20 +48,47 @@ def requires_submit(func):
 class ProjectQJob(BaseJob):
     """ProjectQ Job class.
 
+    The experiments of the qobj are split into contiguous chunks, one per
+    worker of the executor, which run in parallel. The shots of experiments
+    that the backend asks to shard are further split into tasks of their
+    own. The tasks are submitted together, and take a single place in the
+    queue of the executor. All the results are gathered back in order into a
+    single ``Result``.
+
+    When the provider of the backend has a result cache, the experiments
+    the backend reports as deterministic are first looked up in it, and only
+    the others are run.
+
     Attributes:
-        _executor (futures.Executor): executor to handle asynchronous jobs
+        _executor (ProjectQExecutor): executor to handle asynchronous jobs,
+            owned by the provider of the backend
+        _cache (ResultCache): cache of experiment results of the provider,
+            or None
     """
 
-    if sys.platform in ['darwin', 'win32']:
-        _executor = futures.ThreadPoolExecutor()
-    else:
-        _executor = futures.ProcessPoolExecutor()
-
     def __init__(self, backend, job_id, fn, qobj):
+        """
+        Args:
+            backend (BaseBackend): the backend used to run the job
+            job_id (str): a unique id in the context of the backend
+            fn (callable): function running the given experiments of the qobj,
+                as ``fn(job_id, qobj, experiments, shard)``, and returning the
+                dictionary form of their ``Result``. ``shard`` is either None
+                or a pair ``(index, count)`` selecting a share of the shots.
+            qobj (Qobj): the qobj to run
+        """
         super().__init__(backend, job_id)
         self._fn = fn
         self._qobj = qobj
-        self._future = None
+        self._futures = None
+        self._tasks = None
+        self._result = None
+        self._partial_results = {}
+        self._result_lock = threading.Lock()
+        self._executor = getattr(backend.provider(), 'executor', None) or default_executor()
+        self._cache = getattr(backend.provider(), 'result_cache', None)
+        self._cached = {}
+        self._cache_keys = {}
 
     def submit(self):
         """Submit the job to the backend for execution.
@@ -63,12 +98,33 @@ class ProjectQJob(BaseJob):
             during construction does not validate against the Qobj schema.
 
             JobError: if trying to re-submit the job.
+
+            ProjectQSimulatorError: if the executor does not accept more jobs,
+            or a task of the job needs more memory than the executor has.
         """
-        if self._future is not None:
+        if self._futures is not None:
             raise JobError("We have already submitted the job!")
 
         validate_qobj_against_schema(self._qobj)
-        self._future = self._executor.submit(self._fn, self._job_id, self._qobj)
+        self._look_up_cache()
+        tasks = self._plan_tasks()
+        memories = self._plan_memory(tasks)
+        calls = []
+        for (experiments, shard), memory in zip(tasks, memories):
+            if self._executor.is_process_pool:
+                # Large arrays come back through shared memory instead of pickles.
+                calls.append((run_exporting_arrays,
+                              (self._fn, self._job_id, self._qobj, experiments, shard),
+                              memory))
+            else:
+                calls.append((self._fn, (self._job_id, self._qobj, experiments, shard),
+                              memory))
+        self._futures = self._executor.submit_job(calls)
+        self._tasks = tasks
+        # Build the result as soon as the job is done, so that the shared
+        # memory of the exported arrays is released even if it is never read.
+        for future in self._futures:
+            future.add_done_callback(self._collect_result)
 
     @requires_submit
     def result(self, timeout=None):
@@ -88,31 +144,150 @@ class ProjectQJob(BaseJob):
             concurrent.futures.TimeoutError: if timeout occurred.
             concurrent.futures.CancelledError: if job cancelled before completed.
         """
-        return self._future.result(timeout=timeout)
+        _, not_done = futures.wait(self._futures, timeout=timeout)
+        if not_done:
+            raise futures.TimeoutError()
+        result = self._collect_result()
+        for future in self._futures:
+            future.result()
+        return result
+
+    def _collect_result(self, future=None):
+        """Build the ``Result`` from the outputs of the futures, once.
+
+        The exported arrays of each finished task are imported right away,
+        which removes their files from shared memory even if another task of
+        the job failed or was cancelled. The statevector arrays are attached
+        to the ``Result`` as they are, instead of being converted to lists,
+        while the classical states of the per-shot memory are formatted into
+        strings only here, in the parent process.
+
+        Args:
+            future (concurrent.futures.Future): a finished future, when
+                called as a done callback
+
+        Returns:
+            qiskit.Result: Result object, or None if the job did not succeed
+                or is not done yet.
+        """
+        # pylint: disable=unused-argument
+        with self._result_lock:
+            for index, task_future in enumerate(self._futures):
+                if (index not in self._partial_results and task_future.done() and
+                        not task_future.cancelled() and task_future.exception() is None):
+                    self._partial_results[index] = import_arrays(task_future.result())
+            if self._result is None and len(self._partial_results) == len(self._futures):
+                partial_results = [self._partial_results[index]
+                                   for index in range(len(self._futures))]
+                merged = _merge_results(self._tasks, partial_results, self._cached,
+                                        self._base_result())
+                if self._cache is not None and merged['success']:
+                    for index, key in self._cache_keys.items():
+                        if index not in self._cached:
+                            self._cache.put(key, merged['results'][index])
+                self._result = result_from_dict(merged)
+        return self._result
+
+    def _look_up_cache(self):
+        """Find the results of the deterministic experiments in the cache."""
+        cacheable = getattr(self._backend, '_cacheable', None)
+        if self._cache is None or cacheable is None:
+            return
+        for index, experiment in enumerate(self._qobj.experiments):
+            if cacheable(self._qobj, experiment):
+                key = experiment_key(self._backend, self._qobj, index)
+                self._cache_keys[index] = key
+                result = self._cache.get(key)
+                if result is not None:
+                    self._cached[index] = result
+
+    def _base_result(self):
+        """Return the fields of the ``Result`` that do not depend on tasks.
+
+        Returns:
+            dict: the result of a job whose experiments were all cached.
+        """
+        return {'backend_name': self._backend.name(),
+                'backend_version': self._backend.configuration().backend_version,
+                'qobj_id': self._qobj.qobj_id,
+                'job_id': self._job_id,
+                'results': [],
+                'status': 'COMPLETED',
+                'success': True,
+                'time_taken': 0}
+
+    def _plan_tasks(self):
+        """Split the qobj into the tasks submitted to the executor.
+
+        Returns:
+            list[tuple]: pairs of (experiment indices, shard) to run.
+        """
+        shard_count = getattr(self._backend, '_shard_count', None)
+        tasks = []
+        unsharded = []
+        for index, experiment in enumerate(self._qobj.experiments):
+            if index in self._cached:
+                continue
+            n_shards = shard_count(self._qobj, experiment) if shard_count else 1
+            if n_shards > 1:
+                tasks.extend(([index], (shard, n_shards)) for shard in range(n_shards))
+            else:
+                unsharded.append(index)
+        tasks.extend((experiments, None) for experiments in
+                     _split_experiments(unsharded, self._executor.max_workers))
+        return tasks
+
+    def _plan_memory(self, tasks):
+        """Estimate the memory of the tasks, and check that each one fits.
+
+        Args:
+            tasks (list[tuple]): the (experiment indices, shard) of each task
+
+        Returns:
+            list[int]: the estimated number of bytes of each task.
+
+        Raises:
+            ProjectQSimulatorError: if a task needs more memory than the
+                executor can give it.
+        """
+        limit = memory_limit(self._executor)
+        memories = []
+        for experiments, shard in tasks:
+            memory = task_memory(self._backend, self._qobj, experiments, shard,
+                                 self._executor.is_process_pool)
+            check_task_memory(memory, limit, [self._qobj.experiments[index].header.name
+                                              for index in experiments])
+            memories.append(memory)
+        return memories
 
     @requires_submit
     def cancel(self):
-        return self._future.cancel()
+        return all([future.cancel() for future in self._futures])
 
     @requires_submit
     def status(self):
-        """Gets the status of the job by querying the Python's future
+        """Gets the status of the job by querying the Python's futures
 
         Returns:
             JobStatus: The current JobStatus
 
         Raises:
-            JobError: If the future is in unexpected state
+            JobError: If the futures are in unexpected state
             concurrent.futures.TimeoutError: if timeout occurred.
         """
         # The order is important here
-        if self._future.running():
+        if any(future.running() for future in self._futures):
             _status = JobStatus.RUNNING
-        elif self._future.cancelled():
+        elif any(future.cancelled() for future in self._futures):
             _status = JobStatus.CANCELLED
-        elif self._future.done():
-            _status = JobStatus.DONE if self._future.exception() is None else JobStatus.ERROR
-        elif self._future._state == 'PENDING':
+        elif all(future.done() for future in self._futures):
+            if any(future.exception() is not None for future in self._futures):
+                _status = JobStatus.ERROR
+            else:
+                _status = JobStatus.DONE
+        elif any(future.done() for future in self._futures):
+            _status = JobStatus.RUNNING
+        elif all(future._state == 'PENDING' for future in self._futures):
             _status = JobStatus.QUEUED
         else:
             raise JobError('Unexpected behavior of {0}'.format(
@@ -129,3 +304,92 @@ class ProjectQJob(BaseJob):
             Qobj: the Qobj submitted for this job.
         """
         return self._qobj
+
+
+def _split_experiments(experiments, n_chunks):
+    """Split experiment indices into contiguous chunks of similar size.
+
+    Args:
+        experiments (list[int]): the experiment indices
+        n_chunks (int): maximum number of chunks
+
+    Returns:
+        list[list[int]]: the experiment indices of each chunk, in order.
+    """
+    if not experiments:
+        return []
+    n_chunks = max(1, min(len(experiments), n_chunks))
+    size, extra = divmod(len(experiments), n_chunks)
+    chunks = []
+    start = 0
+    for index in range(n_chunks):
+        stop = start + size + (1 if index < extra else 0)
+        chunks.append(experiments[start:stop])
+        start = stop
+    return chunks
+
+
+def _merge_results(tasks, partial_results, cached, base):
+    """Merge the result dictionaries of the tasks of a job.
+
+    Args:
+        tasks (list[tuple]): the (experiment indices, shard) of each task
+        partial_results (list[dict]): result dictionaries, in task order
+        cached (dict): experiment results found in the cache, by index
+        base (dict): result dictionary to use when no task ran
+
+    Returns:
+        dict: a single result dictionary holding all the experiments, in
+            qobj order.
+    """
+    experiment_parts = {index: [result] for index, result in cached.items()}
+    for (experiments, _), partial in zip(tasks, partial_results):
+        for index, experiment in zip(experiments, partial['results']):
+            experiment_parts.setdefault(index, []).append(experiment)
+
+    merged = dict(partial_results[0] if partial_results else base)
+    merged['results'] = [_merge_experiment_results(experiment_parts[index])
+                         for index in sorted(experiment_parts)]
+    merged['success'] = all(partial['success'] for partial in partial_results)
+    # The tasks run in parallel: the job took as long as the slowest one.
+    merged['time_taken'] = max([partial['time_taken'] for partial in partial_results],
+                               default=0)
+    return merged
+
+
+def _merge_experiment_results(parts):
+    """Merge the results of the shot shards of an experiment.
+
+    Counts are added up, while the arrays of per-shot memory, and the
+    snapshots or the references to the snapshot files, are concatenated in
+    shard order.
+
+    Args:
+        parts (list[dict]): experiment result dictionaries, in shard order
+
+    Returns:
+        dict: the experiment result of all the shots.
+    """
+    if len(parts) == 1:
+        return parts[0]
+    merged = dict(parts[0])
+    data = {}
+    counts = {}
+    memories = []
+    for part in parts:
+        for key, value in part['data'].get('counts', {}).items():
+            counts[key] = counts.get(key, 0) + value
+        if 'memory' in part['data']:
+            memories.append(part['data']['memory'])
+        for label, snapshot in part['data'].get('snapshots', {}).items():
+            merged_snapshot = data.setdefault('snapshots', {}).setdefault(label, {})
+            for key, values in snapshot.items():
+                merged_snapshot.setdefault(key, []).extend(values)
+    data['counts'] = counts
+    if memories:
+        data['memory'] = np.concatenate(memories)
+    merged['data'] = data
+    merged['shots'] = sum(part['shots'] for part in parts)
+    merged['success'] = all(part['success'] for part in parts)
+    merged['time_taken'] = max(part['time_taken'] for part in parts)
+    return merged
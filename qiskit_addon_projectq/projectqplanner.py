@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018, IBM.
+#
+# This source code is licensed under the Apache License, Version 2.0 found in
+# the LICENSE.txt file in the root directory of this source tree.
+
+"""
+Memory planning of ProjectQ jobs.
+
+Before a job is submitted, the peak memory of each of its tasks is estimated
+from the width, precision and snapshots of its experiments. The executor
+uses the estimates to keep concurrent tasks under its memory budget, and a
+task that could never fit is rejected right away: a worker running out of
+memory would otherwise be killed, and take a process pool down with it.
+
+The footprint of an experiment has two parts:
+
+- its working memory, only needed while it is simulated: the state of the
+  C++ simulator, and the temporary copies read back from it,
+- the memory retained by its result until the task returns: the final
+  statevector, the snapshots and the outcome of every shot.
+
+The experiments of a task run one after the other, so the task needs the
+working memory of its widest experiment, and the retained memory of all of
+them.
+
+The parent process builds the ``Result`` around the returned arrays, without
+converting them to lists, and ``get_statevector`` views them as complex
+vectors: the retained memory is all the job's ``Result`` holds on to, with no
+further copy to plan for.
+"""
+
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from .projectqsimulatorerror import ProjectQSimulatorError
+
+# The C++ simulator always holds complex128 amplitudes.
+SIMULATOR_BYTES_PER_AMPLITUDE = 16
+# Reading the state back goes through a list of Python complex numbers:
+# an 8 byte pointer and a 32 byte object per amplitude.
+READBACK_BYTES_PER_AMPLITUDE = 40
+# Sampling shots builds the probabilities and their cumulative sums.
+SAMPLING_BYTES_PER_AMPLITUDE = 16
+# The classical state of one shot, and its entry in the formatted memory.
+SHOT_BYTES = 16
+
+Footprint = namedtuple('Footprint', ['working', 'retained'])
+Footprint.__doc__ = """Estimated memory of one experiment.
+
+Attributes:
+    working (int): bytes needed while the experiment is simulated
+    retained (int): bytes held by its result
+"""
+
+
+def statevector_bytes(n_qubits, dtype):
+    """Size of a statevector on the Python side.
+
+    Args:
+        n_qubits (int): number of qubits
+        dtype (numpy.dtype): complex64 or complex128
+
+    Returns:
+        int: number of bytes.
+    """
+    return np.dtype(dtype).itemsize << n_qubits
+
+
+def simulation_bytes(n_qubits, dtype):
+    """Working memory of simulating an experiment.
+
+    This covers the state of the C++ simulator, the list it is read back
+    through, the shot sampling buffers, and two statevectors on the Python
+    side: the one read back, and the ground or initial state loaded into the
+    simulator.
+
+    Args:
+        n_qubits (int): number of qubits
+        dtype (numpy.dtype): complex64 or complex128
+
+    Returns:
+        int: number of bytes.
+    """
+    amplitudes = 1 << n_qubits
+    return (amplitudes * (SIMULATOR_BYTES_PER_AMPLITUDE + READBACK_BYTES_PER_AMPLITUDE +
+                          SAMPLING_BYTES_PER_AMPLITUDE) +
+            2 * statevector_bytes(n_qubits, dtype))
+
+
+def count_snapshots(circuit):
+    """Number of snapshot instructions of an experiment.
+
+    Args:
+        circuit (QobjExperiment): Qobj experiment
+
+    Returns:
+        int: the number of statevectors saved by one run of the experiment.
+    """
+    return sum(1 for operation in circuit.instructions if operation.name == 'snapshot')
+
+
+def task_memory(backend, qobj, experiments, shard, process_pool):
+    """Estimate the peak number of bytes of a task.
+
+    Args:
+        backend (BaseBackend): the backend running the task. Its
+            ``_footprint(qobj, circuit, shard)`` method, when it has one,
+            gives the ``Footprint`` of each experiment.
+        qobj (Qobj): the qobj of the task
+        experiments (list[int]): indices of the experiments of the task
+        shard (tuple): ``(index, count)`` share of the shots run by the task,
+            or None
+        process_pool (bool): whether the task runs in a worker process, whose
+            large result arrays are copied to shared memory on return
+
+    Returns:
+        int: estimated number of bytes.
+    """
+    footprint = getattr(backend, '_footprint', None)
+    working = 0
+    retained = 0
+    for index in experiments:
+        circuit = qobj.experiments[index]
+        if footprint is None:
+            experiment = Footprint(simulation_bytes(circuit.config.n_qubits, complex), 0)
+        else:
+            experiment = footprint(qobj, circuit, shard)
+        working = max(working, experiment.working)
+        retained += experiment.retained
+    if process_pool:
+        retained *= 2
+    return working + retained
+
+
+def memory_limit(executor):
+    """Largest task an executor can run.
+
+    Args:
+        executor (ProjectQExecutor): the executor
+
+    Returns:
+        int: the memory budget of the executor less the memory it reserves,
+            or the physical memory of the machine when it has no budget, or
+            None if neither is known.
+    """
+    if executor.memory_budget is None:
+        return physical_memory()
+    return max(0, executor.memory_budget - executor.reserved_memory)
+
+
+def physical_memory():
+    """Total physical memory of the machine.
+
+    Returns:
+        int: number of bytes, or None if the platform does not report it.
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def check_task_memory(memory, limit, names):
+    """Reject a task larger than the memory available to it.
+
+    Args:
+        memory (int): estimated number of bytes of the task
+        limit (int): number of bytes available, or None for no limit
+        names (list[str]): names of the experiments of the task
+
+    Raises:
+        ProjectQSimulatorError: if the task does not fit.
+    """
+    if limit is not None and memory > limit:
+        raise ProjectQSimulatorError(
+            'Experiments {} need about {} of memory, more than the {} available: '
+            'use fewer qubits, shots or snapshots, shard the shots, or raise the '
+            'memory budget.'.format(', '.join(names), _format_bytes(memory),
+                                    _format_bytes(limit)))
+
+
+def _format_bytes(size):
+    """Format a number of bytes for error messages, e.g. '1.5 GiB'."""
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024
+    return '{:.1f} TiB'.format(size)
@@ -10,18 +10,87 @@
 from qiskit.providers import BaseProvider
 from qiskit.providers.providerutils import filter_backends
 
-from .statevector_simulator_projectq import StatevectorSimulatorProjectQ
+from .probability_simulator_projectq import ProbabilitySimulatorProjectQ
+from .projectqexecutor import ProjectQExecutor
+from .projectqsimulatorerror import ProjectQSimulatorError
+from .statevector_simulator_projectq import (DEFAULT_STATEVECTOR_CACHE_BYTES,
+                                             StatevectorSimulatorProjectQ)
 from .qasm_simulator_projectq import QasmSimulatorProjectQ
 
 
 class ProjectQProvider(BaseProvider):
-    """Provider for ProjectQ backends."""
-    def __init__(self, *args, **kwargs):
+    """Provider for ProjectQ backends.
+
+    The provider owns the pool of workers running the jobs of its backends,
+    and optionally a cache of the results of their deterministic experiments.
+
+    Attributes:
+        executor (ProjectQExecutor): the worker pool of the provider
+        result_cache (ResultCache): the result cache of the provider, or None
+        statevector_cache_bytes (int): size limit of the cache of final
+            statevectors of the statevector simulator, in each process
+            running its jobs
+    """
+    def __init__(self, *args, max_workers=None, executor_mode=None,
+                 max_queue_size=None, memory_budget=None, result_cache=None,
+                 statevector_cache_bytes=None, **kwargs):
+        """
+        Args:
+            *args: positional arguments of the base provider
+            max_workers (int): maximum number of tasks running at the same time
+            executor_mode (str): 'thread' or 'process'. Defaults to processes
+                on Linux, and to threads on macOS and Windows.
+            max_queue_size (int): maximum number of jobs waiting or running,
+                whatever their number of tasks, after which submitting a job
+                raises an error
+            memory_budget (int): maximum number of bytes used by the running
+                tasks; larger tasks wait for the running ones to finish, and
+                jobs with a task estimated to need more than the whole budget
+                are rejected. Without a budget, jobs are only rejected when a
+                task needs more than the physical memory of the machine.
+            result_cache (ResultCache): cache returning the results of seeded
+                experiments that were already run, or None to disable caching
+            statevector_cache_bytes (int): size limit of the cache of final
+                statevectors of each process running statevector simulations,
+                0 to disable it. It defaults to 256 MiB, or to a quarter of
+                the memory budget split between the processes if that is
+                smaller. When there is a memory budget, the caches of all the
+                processes are set aside from it.
+            **kwargs: keyword arguments of the base provider
+
+        Raises:
+            ProjectQSimulatorError: if the statevector caches do not leave any
+                of the memory budget to the jobs.
+        """
         super().__init__(args, kwargs)
+        self.executor = ProjectQExecutor(max_workers=max_workers,
+                                         mode=executor_mode,
+                                         max_queue_size=max_queue_size,
+                                         memory_budget=memory_budget)
+        self.result_cache = result_cache
+
+        # Worker processes each have their own cache, worker threads share
+        # the one of this process.
+        processes = self.executor.max_workers if self.executor.is_process_pool else 1
+        if statevector_cache_bytes is None:
+            statevector_cache_bytes = DEFAULT_STATEVECTOR_CACHE_BYTES
+            if memory_budget is not None:
+                statevector_cache_bytes = min(statevector_cache_bytes,
+                                              memory_budget // (4 * processes))
+        self.statevector_cache_bytes = statevector_cache_bytes
+        if memory_budget is not None:
+            self.executor.reserved_memory = statevector_cache_bytes * processes
+            if self.executor.reserved_memory >= memory_budget:
+                self.executor.shutdown(wait=False)
+                raise ProjectQSimulatorError(
+                    'The statevector caches of {} processes take {} bytes, the whole memory '
+                    'budget of {} bytes.'.format(processes, self.executor.reserved_memory,
+                                                 memory_budget))
 
         # Populate the list of local ProjectQ backends.
         self._backends = [StatevectorSimulatorProjectQ(provider=self),
-                          QasmSimulatorProjectQ(provider=self)]
+                          QasmSimulatorProjectQ(provider=self),
+                          ProbabilitySimulatorProjectQ(provider=self)]
 
     def get_backend(self, name=None, **kwargs):
         return super().get_backend(name=name, **kwargs)
@@ -34,5 +103,21 @@ class ProjectQProvider(BaseProvider):
 
         return filter_backends(backends, filters=filters, **kwargs)
 
+    def shutdown(self, wait=True):
+        """Shut the worker pool of the provider down.
+
+        Args:
+            wait (bool): whether to wait for the running jobs to finish
+        """
+        self.executor.shutdown(wait=wait)
+
+    def __getstate__(self):
+        # The worker pool and the cache stay in the process that created them:
+        # backends sent to worker processes carry their provider without them.
+        state = self.__dict__.copy()
+        state['executor'] = None
+        state['result_cache'] = None
+        return state
+
     def __str__(self):
         return 'ProjectQProvider'
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018, IBM.
+#
+# This source code is licensed under the Apache License, Version 2.0 found in
+# the LICENSE.txt file in the root directory of this source tree.
+
+"""
+Results holding their statevectors as NumPy arrays.
+
+``Result.from_dict`` validates the final statevector of each experiment as a
+list of complex numbers, turning every amplitude into Python objects: for
+large experiments, this takes longer and needs more memory than the
+simulation itself. The ``Result`` is instead built from the other fields of
+the result dictionary, and the statevector arrays are attached to the data of
+its experiments afterwards.
+
+The outcomes of the shots come back from the simulation as an array of
+integer classical states, which is only formatted into the hexadecimal
+strings of the per-shot memory here, once the shards are merged.
+"""
+
+import numpy as np
+
+from qiskit import QiskitError
+from qiskit.result import Result
+from qiskit.result.models import ExperimentResultData
+
+
+class ProjectQResult(Result):
+    """``Result`` whose final statevectors may be NumPy arrays.
+
+    The arrays hold each amplitude as a ``[real, imag]`` pair, in shape
+    ``(2**n, 2)``. ``data`` returns them as they are, and ``get_statevector``
+    views them as complex vectors, without going through lists.
+    """
+
+    def data(self, circuit=None):
+        """Get the raw data for an experiment.
+
+        Args:
+            circuit (str or QuantumCircuit or int or None): the index of the
+                experiment, as specified by ``Result.data``.
+
+        Returns:
+            dict: the data of the experiment, with its statevector array.
+
+        Raises:
+            QiskitError: if data for the experiment could not be retrieved.
+        """
+        try:
+            fields = dict(vars(self._get_experiment(circuit).data))
+        except (KeyError, TypeError):
+            raise QiskitError('No data for circuit "{0}"'.format(circuit))
+        statevector = fields.pop('statevector', None)
+        if not isinstance(statevector, np.ndarray):
+            return super().data(circuit)
+        data = ExperimentResultData(**fields).to_dict()
+        data['statevector'] = statevector
+        return data
+
+    def get_statevector(self, circuit=None, decimals=None):
+        """Get the final statevector of an experiment.
+
+        Args:
+            circuit (str or QuantumCircuit or int or None): the index of the
+                experiment, as specified by ``Result.data``.
+            decimals (int): the number of decimals in the statevector.
+                If None, does not round.
+
+        Returns:
+            numpy.ndarray: the 2**n complex amplitudes, in the precision of
+                the simulation. Without rounding, it is a view of the array
+                of the result.
+
+        Raises:
+            QiskitError: if there is no statevector for the experiment.
+        """
+        statevector = self.data(circuit).get('statevector')
+        if not isinstance(statevector, np.ndarray):
+            return super().get_statevector(circuit, decimals)
+        statevector = _complex_view(statevector)
+        if decimals:
+            statevector = np.around(statevector, decimals=decimals)
+        return statevector
+
+
+def result_from_dict(result):
+    """Build a ``ProjectQResult`` without converting its statevector arrays.
+
+    The arrays of classical states of the per-shot memory are formatted as
+    hexadecimal strings.
+
+    Args:
+        result (dict): the dictionary form of the result, left unchanged
+
+    Returns:
+        ProjectQResult: the result.
+    """
+    statevectors = {}
+    experiments = []
+    for index, experiment in enumerate(result['results']):
+        data = dict(experiment.get('data', {}))
+        if isinstance(data.get('statevector'), np.ndarray):
+            statevectors[index] = data.pop('statevector')
+        if isinstance(data.get('memory'), np.ndarray):
+            data['memory'] = _format_memory(data['memory'])
+        experiments.append(dict(experiment, data=data))
+    converted = ProjectQResult(**vars(Result.from_dict(dict(result, results=experiments))))
+    for index, statevector in statevectors.items():
+        converted.results[index].data.statevector = statevector
+    return converted
+
+
+def _complex_view(statevector):
+    """View an array of ``[real, imag]`` pairs as complex amplitudes.
+
+    Args:
+        statevector (numpy.ndarray): float32 or float64 array of shape
+            ``(2**n, 2)``
+
+    Returns:
+        numpy.ndarray: complex64 or complex128 vector of the 2**n amplitudes,
+            sharing the memory of ``statevector`` when it is contiguous.
+    """
+    statevector = np.ascontiguousarray(statevector)
+    if statevector.dtype not in (np.float32, np.float64):
+        statevector = statevector.astype(np.float64)
+    complex_dtype = np.complex64 if statevector.dtype == np.float32 else np.complex128
+    return statevector.view(complex_dtype).reshape(-1)
+
+
+def _format_memory(classical_states):
+    """Format the classical state of every shot as a hexadecimal string.
+
+    Only the distinct states are formatted, and every shot refers to one of
+    the resulting strings.
+
+    Args:
+        classical_states (numpy.ndarray): classical state of every shot
+
+    Returns:
+        list[str]: the memory of the shots, e.g. ['0x0', '0xf', '0x0'].
+    """
+    values, inverse = np.unique(classical_states, return_inverse=True)
+    keys = [hex(int(value)) for value in values]
+    return [keys[index] for index in inverse.tolist()]
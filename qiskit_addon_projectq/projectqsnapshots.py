@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018, IBM.
+#
+# This source code is licensed under the Apache License, Version 2.0 found in
+# the LICENSE.txt file in the root directory of this source tree.
+
+"""
+Snapshots streamed to disk.
+
+By default, every snapshot of every shot is kept in memory until the
+experiment returns. When the ``snapshot_directory`` option of the qobj config
+is set, each snapshot is instead appended to a ``.npy`` file of that
+directory as soon as it is taken, one file per snapshot label, and the
+result only holds references to the rows of the files::
+
+    {'statevector_files': [{'path': '.../snapshot-<id>.npy', 'rows': [0, 1]}]}
+
+The files can be memory-mapped with ``load_snapshot``. With the
+``snapshot_dedupe`` option, a snapshot identical to one already written to
+the same file is not written again, and refers to its row instead.
+"""
+
+import hashlib
+import os
+import uuid
+
+import numpy as np
+
+# Number of digits reserved in the header for the number of rows, which is
+# only known when the file is closed.
+_ROW_COUNT_DIGITS = 20
+
+
+class SnapshotSink(object):
+    """Writer of the snapshots of one experiment to ``.npy`` files.
+
+    Attributes:
+        directory (str): directory of the snapshot files
+        dedupe (bool): whether identical snapshots share a single row
+    """
+
+    def __init__(self, directory, dedupe=False):
+        """
+        Args:
+            directory (str): directory of the snapshot files, created if
+                needed
+            dedupe (bool): whether identical snapshots share a single row
+        """
+        self.directory = directory
+        self.dedupe = dedupe
+        self._files = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, label, statevector):
+        """Write a snapshot.
+
+        Args:
+            label (str): label of the snapshot
+            statevector (numpy.ndarray): the formatted statevector, of shape
+                ``(2**n, 2)``
+        """
+        snapshot_file = self._files.get(label)
+        if snapshot_file is None:
+            path = os.path.join(self.directory, 'snapshot-{}.npy'.format(uuid.uuid4().hex))
+            snapshot_file = _SnapshotFile(path, statevector.dtype, statevector.shape)
+            self._files[label] = snapshot_file
+        snapshot_file.append(statevector, self.dedupe)
+
+    def close(self):
+        """Finish the snapshot files.
+
+        Returns:
+            dict: the references to the snapshots of each label, in the form
+                of the ``snapshots`` of an experiment result.
+        """
+        snapshots = {}
+        for label, snapshot_file in self._files.items():
+            snapshot_file.close()
+            snapshots[label] = {'statevector_files': [{'path': snapshot_file.path,
+                                                       'rows': snapshot_file.rows}]}
+        self._files = {}
+        return snapshots
+
+    def discard(self):
+        """Close and remove the snapshot files, when the experiment failed."""
+        for snapshot_file in self._files.values():
+            snapshot_file.discard()
+        self._files = {}
+
+
+class _SnapshotFile(object):
+    """A ``.npy`` file whose rows are appended one snapshot at a time.
+
+    Attributes:
+        path (str): path of the file
+        rows (list[int]): the row of each snapshot appended so far
+    """
+
+    def __init__(self, path, dtype, shape):
+        """
+        Args:
+            path (str): path of the file
+            dtype (numpy.dtype): dtype of the snapshots
+            shape (tuple): shape of one snapshot
+        """
+        self.path = path
+        self.rows = []
+        self._dtype = np.dtype(dtype)
+        self._shape = tuple(shape)
+        self._row_count = 0
+        self._digests = {}
+        self._file = open(path, 'wb')
+        try:
+            self._write_header()
+        except BaseException:
+            self.discard()
+            raise
+
+    def append(self, statevector, dedupe):
+        """Append a snapshot, or refer to an identical one.
+
+        Args:
+            statevector (numpy.ndarray): the snapshot
+            dedupe (bool): whether to look for an identical snapshot
+        """
+        data = np.ascontiguousarray(statevector, dtype=self._dtype)
+        if dedupe:
+            digest = hashlib.sha256(data).digest()
+            row = self._digests.get(digest)
+            if row is not None:
+                self.rows.append(row)
+                return
+            self._digests[digest] = self._row_count
+        self._file.write(data.data)
+        self.rows.append(self._row_count)
+        self._row_count += 1
+
+    def close(self):
+        """Write the final number of rows into the header and close the file."""
+        self._file.seek(0)
+        self._write_header()
+        self._file.close()
+
+    def discard(self):
+        """Close the file, whether or not it was finished, and remove it."""
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _write_header(self):
+        """Write a version 1.0 ``.npy`` header of constant length."""
+        shape = ', '.join(['{:{}d}'.format(self._row_count, _ROW_COUNT_DIGITS)] +
+                          [str(size) for size in self._shape])
+        header = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({}), }}".format(
+            np.lib.format.dtype_to_descr(self._dtype), shape)
+        magic = np.lib.format.magic(1, 0)
+        # The data starts on a 64 byte boundary, after a newline-terminated
+        # header.
+        padding = -(len(magic) + 2 + len(header) + 1) % 64
+        header = (header + ' ' * padding + '\n').encode('latin1')
+        self._file.write(magic + len(header).to_bytes(2, 'little') + header)
+
+
+def load_snapshot(snapshot):
+    """Read the statevectors of a snapshot written to disk.
+
+    Args:
+        snapshot (dict): a snapshot of an experiment result, with
+            ``statevector_files`` references
+
+    Returns:
+        numpy.ndarray: the statevectors, in the order they were taken, of
+            shape ``(count, 2**n, 2)``. It is memory-mapped from the file
+            when the snapshot was written to a single file without
+            deduplication.
+    """
+    parts = []
+    for reference in snapshot['statevector_files']:
+        data = np.load(reference['path'], mmap_mode='r')
+        rows = reference['rows']
+        if rows != list(range(len(data))):
+            data = data[rows]
+        parts.append(data)
+    if len(parts) == 1:
+        return parts[0]
+    return np.concatenate(parts)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018, IBM.
+#
+# This source code is licensed under the Apache License, Version 2.0 found in
+# the LICENSE.txt file in the root directory of this source tree.
+
+"""
+Transfer of large result arrays from worker processes.
+
+Results computed in a worker process are pickled back to the parent. For
+large NumPy arrays (statevectors, snapshots, classical states of the shots)
+the worker instead writes them to a ``.npy`` file in shared memory
+(``/dev/shm`` when available), and only a small ``SharedArray`` descriptor is
+pickled. The parent maps the file back
+into memory and removes it right away.
+"""
+
+import logging
+import os
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Arrays smaller than this are cheaper to pickle than to write to a file.
+SHARED_ARRAY_MIN_BYTES = 1 << 20
+
+SharedArray = namedtuple('SharedArray', ['path'])
+SharedArray.__doc__ = """Descriptor of an array exported to a ``.npy`` file.
+
+Attributes:
+    path (str): path of the file holding the array.
+"""
+
+
+def _shared_directory():
+    """Return the directory used for exported arrays.
+
+    Returns:
+        str: ``/dev/shm`` if it exists, otherwise None for the default
+            temporary directory.
+    """
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return None
+
+
+def export_arrays(obj, min_bytes=SHARED_ARRAY_MIN_BYTES):
+    """Replace the large arrays of a result dictionary by file descriptors.
+
+    Args:
+        obj (dict or list): a result dictionary, or any part of it
+        min_bytes (int): arrays smaller than this are left in place
+
+    Returns:
+        dict or list: ``obj``, with the large arrays replaced in place by
+            ``SharedArray`` descriptors.
+    """
+    items = obj.items() if isinstance(obj, dict) else enumerate(obj)
+    for key, value in list(items):
+        if isinstance(value, np.ndarray):
+            # Arrays of Python objects, such as the classical states of more
+            # than 64 memory slots, can only be pickled.
+            if value.nbytes >= min_bytes and not value.dtype.hasobject:
+                obj[key] = _export_array(value)
+        elif isinstance(value, (dict, list)):
+            export_arrays(value, min_bytes)
+    return obj
+
+
+def import_arrays(obj):
+    """Replace the file descriptors of a result dictionary by arrays.
+
+    The arrays are memory-mapped from their files, which are deleted right
+    away: the mapping stays valid until the arrays are garbage collected.
+
+    Args:
+        obj (dict or list): a result dictionary, or any part of it
+
+    Returns:
+        dict or list: ``obj``, with the ``SharedArray`` descriptors replaced
+            in place by read-only arrays.
+    """
+    items = obj.items() if isinstance(obj, dict) else enumerate(obj)
+    for key, value in list(items):
+        if isinstance(value, SharedArray):
+            obj[key] = _import_array(value)
+        elif isinstance(value, (dict, list)):
+            import_arrays(value)
+    return obj
+
+
+def _export_array(array):
+    """Write an array to a new file in shared memory.
+
+    Args:
+        array (numpy.ndarray): the array to export
+
+    Returns:
+        SharedArray: the descriptor of the file.
+    """
+    handle, path = tempfile.mkstemp(prefix='projectq_', suffix='.npy',
+                                    dir=_shared_directory())
+    with os.fdopen(handle, 'wb') as file:
+        np.save(file, array, allow_pickle=False)
+    return SharedArray(path)
+
+
+def _import_array(shared_array):
+    """Map an exported array back into memory and delete its file.
+
+    Args:
+        shared_array (SharedArray): the descriptor of the file
+
+    Returns:
+        numpy.memmap: the array.
+    """
+    try:
+        return np.load(shared_array.path, mmap_mode='r')
+    finally:
+        try:
+            os.remove(shared_array.path)
+        except OSError:
+            logger.warning('could not remove exported array %s', shared_array.path)
+
+
+def run_exporting_arrays(func, *args):
+    """Run a job function and export the large arrays of its result.
+
+    This is the function submitted to process pools, so that only small
+    descriptors are pickled back to the parent process.
+
+    Args:
+        func (callable): function returning the result dictionary of a job
+        *args: arguments of the function
+
+    Returns:
+        dict: the result dictionary, with its large arrays exported.
+    """
+    return export_arrays(func(*args))
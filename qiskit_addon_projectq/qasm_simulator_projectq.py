@@ -5,51 +5,37 @@
 # This source code is licensed under the Apache License, Version 2.0 found in
 # the LICENSE.txt file in the root directory of this source tree.
 
-# pylint: disable=unused-import
-
 """Backend for the Project Q C++ simulator."""
 
 
+import copy
 import time
-import itertools
-import operator
 import random
 import uuid
 import logging
 import warnings
-from collections import OrderedDict, Counter
 import numpy as np
-from qiskit.result import Result
 from qiskit.providers import BaseBackend
 from qiskit.providers.models import BackendConfiguration
+from .projectqcompiler import (DEFAULT_FUSION_WIDTH, GATE, MEASURE, RESET, X_MATRIX,
+                               bind_parameters, compile_circuit, compile_template,
+                               count_parameters, deterministic_prefix_length, fuse_gates,
+                               is_sampleable, is_sampleable_experiment)
+from .projectqcppsim import CppSim, CppSimulator
+from .projectqexecutor import default_executor
 from .projectqjob import ProjectQJob
+from .projectqplanner import (SHOT_BYTES, Footprint, check_task_memory, count_snapshots,
+                              memory_limit, simulation_bytes, statevector_bytes, task_memory)
+from .projectqresult import result_from_dict
 from .projectqsimulatorerror import ProjectQSimulatorError
-try:
-    from projectq.backends._sim._cppsim import Simulator as CppSim
-except ImportError:
-    CppSim = None
-else:
-    from projectq import MainEngine
-    from projectq.backends import Simulator
-    from projectq.ops import (H,
-                              X,
-                              Y,
-                              Z,
-                              S,
-                              T,
-                              Rx,
-                              Ry,
-                              Rz,
-                              CX,
-                              Toffoli,
-                              Measure,
-                              BasicGate,
-                              BasicMathGate,
-                              QubitOperator,
-                              TimeEvolution,
-                              All)
+from .projectqsnapshots import SnapshotSink
+from .projectqtransfer import import_arrays, run_exporting_arrays
 logger = logging.getLogger(__name__)
 
+# Sweeps return dense arrays over the classical states: 2**20 of them
+# already take 8 MiB per binding.
+MAX_SWEEP_MEMORY_SLOTS = 20
+
 
 class QasmSimulatorProjectQ(BaseBackend):
     """Python interface to Project Q simulator"""
@@ -64,7 +50,7 @@ class QasmSimulatorProjectQ(BaseBackend):
         'basis_gates': ['u1', 'u2', 'u3', 'cx', 'id', 'h', 's', 't'],
         'memory': True,
         'n_qubits': 30,
-        'conditional': False,
+        'conditional': True,
         'max_shots': 100000,
         'open_pulse': False,
         'gates': [
@@ -98,7 +84,12 @@ class QasmSimulatorProjectQ(BaseBackend):
         self._classical_state = 0
         self._seed = None
         self._shots = 0
-        self._sim = None
+        self._memory = False
+        self._shard = None
+        self._fusion_width = DEFAULT_FUSION_WIDTH
+        self._dtype = np.dtype(complex)
+        self._snapshot_directory = None
+        self._snapshot_dedupe = False
 
     def run(self, qobj):
         """Run qobj asynchronously.
@@ -110,7 +101,7 @@ class QasmSimulatorProjectQ(BaseBackend):
             ProjectQJob: derived from BaseJob
         """
         job_id = str(uuid.uuid4())
-        projectq_job = ProjectQJob(self, job_id, self._run_job, qobj)
+        projectq_job = ProjectQJob(self, job_id, self._run_qobj, qobj)
         projectq_job.submit()
         return projectq_job
 
@@ -133,21 +124,59 @@ class QasmSimulatorProjectQ(BaseBackend):
                         'status': 'DONE'
                         }]
         """
+        return result_from_dict(self._run_qobj(job_id, qobj))
+
+    def _run_qobj(self, job_id, qobj, experiments=None, shard=None):
+        """Run circuits in qobj and return the result as a dictionary.
+
+        Snapshots are kept as NumPy arrays in the returned dictionary, so
+        that subclasses can post-process it before a single conversion into
+        a ``Result``.
+
+        Each experiment is seeded from the qobj seed and its own index, so
+        that its outcome does not depend on which other experiments of the
+        qobj ran before it in the same worker.
+
+            Args:
+                qobj (Qobj): Qobj structure
+                job_id (str): A job id
+                experiments (list[int]): indices of the experiments to run,
+                    defaults to all of them
+                shard (tuple): ``(index, count)`` to only run the index-th of
+                    count shares of the shots, or None to run all of them
+
+            Returns:
+                dict: the dictionary form of the ``Result``.
+        """
+        # The tasks of a thread pool run concurrently on the same backend:
+        # keep the state of this one on a shallow copy of it.
+        runner = copy.copy(self)
+        return runner._run_experiments(job_id, qobj, experiments, shard)
+
+    def _run_experiments(self, job_id, qobj, experiments, shard):
+        """Run circuits in qobj on this backend.
+
+            Args:
+                qobj (Qobj): Qobj structure
+                job_id (str): A job id
+                experiments (list[int]): indices of the experiments to run,
+                    or None for all of them
+                shard (tuple): ``(index, count)`` share of the shots to run,
+                    or None to run all of them
 
+            Returns:
+                dict: the dictionary form of the ``Result``.
+        """
         result_list = []
-        self._validate(qobj)
-        self._sim = Simulator(gate_fusion=True)
-        if hasattr(qobj.config, 'seed'):
-            self._seed = qobj.config.seed
-            self._sim._simulator = CppSim(self._seed)
-        else:
-            self._seed = random.getrandbits(32)
-        self._shots = qobj.config.shots
+        self._configure(qobj, shard)
+        if experiments is None:
+            experiments = range(len(qobj.experiments))
         start = time.time()
-        for circuit in qobj.experiments:
-            result_list.append(self.run_circuit(circuit))
+        for index in experiments:
+            # The C++ simulator takes an unsigned 32 bit seed.
+            result_list.append(self.run_circuit(qobj.experiments[index],
+                                                seed=(self._seed + index) % (1 << 32)))
         end = time.time()
-        job_id = str(uuid.uuid4())
 
         result = {'backend_name': self._configuration.backend_name,
                   'backend_version': '0.1.0',
@@ -157,13 +186,177 @@ class QasmSimulatorProjectQ(BaseBackend):
                   'status': 'COMPLETED',
                   'success': True,
                   'time_taken': (end - start)}
-        return Result.from_dict(result)
+        return result
+
+    def _configure(self, qobj, shard):
+        """Validate a qobj and set up this backend to run it.
+
+        Args:
+            qobj (Qobj): Qobj structure
+            shard (tuple): ``(index, count)`` share of the shots to run, or
+                None to run all of them
+        """
+        self._validate(qobj)
+        if hasattr(qobj.config, 'seed'):
+            self._seed = qobj.config.seed
+        else:
+            self._seed = random.getrandbits(32)
+        self._shots = qobj.config.shots
+        self._shard = shard
+        if shard is not None:
+            self._shots = _shard_shots(self._shots, *shard)
+        self._memory = getattr(qobj.config, 'memory', False)
+        self._fusion_width = getattr(qobj.config, 'fusion_width', DEFAULT_FUSION_WIDTH)
+        self._dtype = precision_dtype(getattr(qobj.config, 'precision', None))
+        self._snapshot_directory = getattr(qobj.config, 'snapshot_directory', None)
+        self._snapshot_dedupe = getattr(qobj.config, 'snapshot_dedupe', False)
+
+    def sweep(self, qobj, parameters):
+        """Run one experiment for many values of its gate angles.
+
+        The angles of the u1, u2 and u3 gates of the experiment, in
+        instruction order, are its parameters. The experiment is compiled
+        once, and every binding of the parameters runs on the same simulator
+        in a single worker, without going through a job.
+
+        Args:
+            qobj (Qobj): Qobj structure with a single experiment, the template
+            parameters (array_like): the bindings, of shape
+                ``(bindings, parameters)``
+
+        Returns:
+            numpy.ndarray: the counts of every classical state for every
+                binding, of shape ``(bindings, 2**memory_slots)``. The
+                statevector simulator returns the statevectors instead, and
+                the probability simulator the exact probabilities.
+
+        Raises:
+            ProjectQSimulatorError: if the qobj does not have one experiment,
+                the parameters do not match its parametrized gates, the
+                result would be too large, or the sweep needs more memory
+                than the executor has.
+        """
+        if len(qobj.experiments) != 1:
+            raise ProjectQSimulatorError(
+                'A sweep runs a single experiment, not {}.'.format(len(qobj.experiments)))
+        executor = getattr(self.provider(), 'executor', None) or default_executor()
+        sweep_bytes = self._sweep_bytes(qobj, len(parameters))
+        if executor.is_process_pool:
+            sweep_bytes *= 2
+        memory = task_memory(self, qobj, [0], None, executor.is_process_pool) + sweep_bytes
+        check_task_memory(memory, memory_limit(executor), [qobj.experiments[0].header.name])
+        if executor.is_process_pool:
+            future = executor.submit(run_exporting_arrays, self._run_sweep, qobj, parameters,
+                                     memory=memory)
+        else:
+            future = executor.submit(self._run_sweep, qobj, parameters, memory=memory)
+        return import_arrays(future.result())['sweep']
 
-    def run_circuit(self, circuit):
+    def _run_sweep(self, qobj, parameters):
+        """Run a sweep in a worker.
+
+        Args:
+            qobj (Qobj): Qobj structure with a single experiment
+            parameters (array_like): the bindings of its parameters
+
+        Returns:
+            dict: the result array of the sweep, under the 'sweep' key.
+        """
+        runner = copy.copy(self)
+        runner._configure(qobj, None)
+        circuit = qobj.experiments[0]
+        program, slots = compile_template(circuit, self._configuration.backend_name)
+        parameters = np.asarray(parameters, dtype=float)
+        if parameters.ndim != 2 or parameters.shape[1] != count_parameters(slots):
+            raise ProjectQSimulatorError(
+                'In circuit {}: expected parameters of shape (bindings, {}), got {}.'.format(
+                    circuit.header.name, count_parameters(slots), parameters.shape))
+        return {'sweep': runner._sweep_circuit(circuit, program, slots, parameters)}
+
+    def _sweep_circuit(self, circuit, program, slots, parameters):
+        """Run a compiled template for every binding of its parameters.
+
+        Args:
+            circuit (QobjExperiment): Qobj experiment of the template
+            program (list[CompiledOperation]): the compiled template
+            slots (list[tuple]): its parametrized gates
+            parameters (numpy.ndarray): the bindings, one per row
+
+        Returns:
+            numpy.ndarray: the counts of every classical state for every
+                binding, of shape ``(bindings, 2**memory_slots)``.
+        """
+        self._number_of_qubits = circuit.config.n_qubits
+        self._number_of_clbits = circuit.config.memory_slots
+        seed = self._circuit_seed(circuit, self._seed)
+        simulator = CppSimulator(self._number_of_qubits, seed, self._dtype)
+        counts = np.zeros((len(parameters), 1 << self._number_of_clbits), dtype=np.int64)
+        for index, values in enumerate(parameters.tolist()):
+            if index > 0:
+                simulator.reset((seed + index) % (1 << 32))
+            bound = fuse_gates(bind_parameters(program, slots, values,
+                                               self._configuration.backend_name),
+                               self._fusion_width)
+            classical_states = self._run_shots(simulator, bound, seed + index, {})
+            counts[index] = np.bincount(classical_states.astype(np.int64),
+                                        minlength=1 << self._number_of_clbits)
+        return counts
+
+    def _sweep_bytes(self, qobj, bindings):
+        """Estimate the memory of the result of a sweep.
+
+        The result holds one row of counts per binding, and one more row is
+        needed while the counts of a binding are computed. The counts are 64
+        bit integers whatever the precision of the statevectors.
+
+        Args:
+            qobj (Qobj): Qobj structure with the single experiment of the
+                template
+            bindings (int): number of bindings of the parameters
+
+        Returns:
+            int: number of bytes.
+
+        Raises:
+            ProjectQSimulatorError: if the circuit has more than
+                ``MAX_SWEEP_MEMORY_SLOTS`` memory slots.
+        """
+        circuit = qobj.experiments[0]
+        memory_slots = circuit.config.memory_slots
+        if memory_slots > MAX_SWEEP_MEMORY_SLOTS:
+            raise ProjectQSimulatorError(
+                'In circuit {}: sweeps support at most {} memory slots, not {}.'.format(
+                    circuit.header.name, MAX_SWEEP_MEMORY_SLOTS, memory_slots))
+        return (bindings + 1) * (np.dtype(np.int64).itemsize << memory_slots)
+
+    def _circuit_seed(self, circuit, seed):
+        """Return the seed an experiment runs with.
+
+        Args:
+            circuit (QobjExperiment): Qobj experiment
+            seed (int): seed of the experiment, defaults to the qobj seed
+
+        Returns:
+            int: the seed of the experiment, or of its shard of the shots,
+                in the unsigned 32 bit range of the C++ simulator.
+        """
+        # let circuit seed override qobj default
+        if seed is None:
+            seed = self._seed
+        if hasattr(circuit, 'config'):
+            if hasattr(circuit.config, 'seed'):
+                if circuit.config.seed is not None:
+                    seed = circuit.config.seed
+        if self._shard is not None:
+            seed = _shard_seed(seed, *self._shard)
+        return seed % (1 << 32)
+
+    def run_circuit(self, circuit, seed=None):
         """Run a circuit and return a single Result.
 
         Args:
             circuit (QobjExperiment): Qobj experiment
+            seed (int): seed of the experiment, defaults to the qobj seed
 
         Returns:
             dict: A dictionary of results which looks something like:
@@ -179,144 +372,118 @@ class QasmSimulatorProjectQ(BaseBackend):
         Raises:
             ProjectQSimulatorError: if an error occurred.
         """
-        # pylint: disable=expression-not-assigned,pointless-statement
         self._number_of_qubits = circuit.config.n_qubits
         self._number_of_clbits = circuit.config.memory_slots
         self._classical_state = 0
-        cl_reg_index = []  # starting bit index of classical register
-        cl_reg_nbits = []  # number of bits in classical register
-        clbit_index = 0
-        qobj_quregs = OrderedDict(_get_register_specs(
-            circuit.header.qubit_labels))
-        eng = MainEngine(backend=self._sim)
-        for cl_reg in circuit.header.clbit_labels:
-            cl_reg_nbits.append(cl_reg[1])
-            cl_reg_index.append(clbit_index)
-            clbit_index += cl_reg[1]
-        # let circuit seed override qobj default
-        if hasattr(circuit, 'config'):
-            if hasattr(circuit.config, 'seed'):
-                if circuit.config.seed is not None:
-                    self._sim._simulator = CppSim(circuit.config.seed)
-        outcomes = []
-        snapshots = {}
-        projq_qureg_dict = OrderedDict(((key, eng.allocate_qureg(size))
-                                        for key, size in
-                                        qobj_quregs.items()))
-
-        if self._shots > 1:
-            ground_state = np.zeros(1 << self._number_of_qubits, dtype=complex)
-            ground_state[0] = 1
+        seed = self._circuit_seed(circuit, seed)
+        simulator = CppSimulator(self._number_of_qubits, seed, self._dtype)
+        program = fuse_gates(compile_circuit(circuit, self._configuration.backend_name),
+                             self._fusion_width)
 
         start = time.time()
-        for i in range(self._shots):
-            # initialize starting state
-            self._classical_state = 0
-
-            qureg = [qubit for sublist in projq_qureg_dict.values()
-                     for qubit in sublist]
-
-            if i > 0:
-                eng.flush()
-                eng.backend.set_wavefunction(ground_state, qureg)
-
-            # Do each operation in this shot
-            for operation in circuit.instructions:
-                if hasattr(operation, 'conditional'):
-                    mask = int(operation.conditional.mask, 16)
-                    if mask > 0:
-                        value = self._classical_state & mask
-                        while (mask & 0x1) == 0:
-                            mask >>= 1
-                            value >>= 1
-                        if value != int(operation.conditional.val, 16):
-                            continue
-                # Check if single gate
-                if operation.name in ['U', 'u3']:
-                    params = operation.params
-                    qubit = qureg[operation.qubits[0]]
-                    Rz(params[2]) | qubit
-                    Ry(params[0]) | qubit
-                    Rz(params[1]) | qubit
-                elif operation.name in ['u1']:
-                    params = operation.params
-                    qubit = qureg[operation.qubits[0]]
-                    Rz(params[0]) | qubit
-                elif operation.name in ['u2']:
-                    params = operation.params
-                    qubit = qureg[operation.qubits[0]]
-                    Rz(params[1] - np.pi/2) | qubit
-                    Rx(np.pi/2) | qubit
-                    Rz(params[0] + np.pi/2) | qubit
-                elif operation.name == 't':
-                    qubit = qureg[operation.qubits[0]]
-                    T | qubit
-                elif operation.name == 'h':
-                    qubit = qureg[operation.qubits[0]]
-                    H | qubit
-                elif operation.name == 's':
-                    qubit = qureg[operation.qubits[0]]
-                    S | qubit
-                elif operation.name in ['CX', 'cx']:
-                    qubit0 = qureg[operation.qubits[0]]
-                    qubit1 = qureg[operation.qubits[1]]
-                    CX | (qubit0, qubit1)
-                elif operation.name in ['id', 'u0']:
-                    pass
-                # Check if measure
-                elif operation.name == 'measure':
-                    qubit_index = operation.qubits[0]
-                    qubit = qureg[qubit_index]
-                    clbit = operation.memory[0]
-                    Measure | qubit
-                    bit = 1 << clbit
-                    self._classical_state = (
-                        self._classical_state & (~bit)) | (int(qubit)
-                                                           << clbit)
-                # Check if reset
-                elif operation.name == 'reset':
-                    qubit = operation.qubits[0]
-                    raise ProjectQSimulatorError('Reset operation not yet implemented '
-                                                 'for ProjectQ C++ backend')
-                # Check if snapshot
-                elif operation.name == 'snapshot':
-                    eng.flush()
-                    location = str(operation.params[0])
-                    statevector = np.array(eng.backend.cheat()[1], dtype=complex)
-
-                    formatted_state = [[x.real, x.imag] for x in statevector]
-                    if location in snapshots:
-                        snapshots[location]['statevector'].append(formatted_state)
-                    else:
-                        snapshots[location] = {'statevector': [formatted_state]}
-                elif operation.name == 'barrier':
-                    pass
-                else:
-                    backend = self._configuration.backend_name
-                    err_msg = '{0} encountered unrecognized operation "{1}"'
-                    raise ProjectQSimulatorError(err_msg.format(backend,
-                                                                operation.name))
-
-            # Before the program terminates, all the qubits must be measured,
-            # including those that have not been measured by the circuit.
-            # Otherwise ProjectQ throws an exception about qubits in superposition.
-            for ind in list(range(self._number_of_qubits)):
-                qubit = qureg[ind]
-                Measure | qubit
-            eng.flush()
-            # Turn classical_state (int) into bit string
-            state = format(self._classical_state, 'b')
-            outcomes.append(state.zfill(self._number_of_clbits))
-
-        # Return the results
-        counts = dict(Counter(outcomes))
-        data = {'counts': _format_result(counts, cl_reg_nbits)}
+        snapshots = self._open_snapshots()
+        try:
+            classical_states = self._run_shots(simulator, program, seed, snapshots)
+            snapshots = _close_snapshots(snapshots)
+        except BaseException:
+            _discard_snapshots(snapshots)
+            raise
+
+        # Return the results, derived from the classical state of each shot
+        self._classical_state = int(classical_states[-1])
+        data = _format_result(classical_states, self._memory)
         if snapshots != {}:
             data['snapshots'] = snapshots
         if self._shots == 1:
             data['classical_state'] = self._classical_state
         end = time.time()
+        return self._experiment_result(circuit, data, end - start)
+
+    def _run_shots(self, simulator, program, seed, snapshots):
+        """Run all the shots of a compiled program.
 
+        Args:
+            simulator (CppSimulator): simulator holding the qubits, in the
+                ground state
+            program (list[CompiledOperation]): the compiled circuit
+            seed (int): seed of the experiment
+            snapshots (dict or SnapshotSink): where the snapshots taken during
+                the shots are recorded
+
+        Returns:
+            numpy.ndarray: the classical state of each shot.
+        """
+        if is_sampleable(program, self._number_of_clbits):
+            # Simulate the unitary part once and draw every shot from the
+            # final probability distribution.
+            measurements = []
+            reset_qubits = set()
+            for operation in program:
+                if operation.kind == MEASURE:
+                    qubit = operation.targets[0]
+                    measurements.append((None if qubit in reset_qubits else qubit,
+                                         operation.clbit))
+                elif operation.kind == RESET:
+                    reset_qubits.add(operation.targets[0])
+                else:
+                    simulator.apply_controlled_gate(operation.matrix, operation.targets,
+                                                    operation.controls)
+            classical_states = self._sample_measurements(simulator, measurements, seed)
+        else:
+            # The state before the first measurement or conditional is the
+            # same in every shot: simulate it once and restore it afterwards.
+            prefix_length = deterministic_prefix_length(program)
+            self._run_program(simulator, program[:prefix_length], snapshots)
+            program = program[prefix_length:]
+            classical_states = np.zeros(self._shots,
+                                        dtype=_classical_state_dtype(self._number_of_clbits))
+            initial_state = None
+            final_bits = None
+            if self._shots > 1 and prefix_length > 0:
+                initial_state = simulator.statevector()
+
+            for i in range(self._shots):
+                if initial_state is not None and i > 0:
+                    simulator.set_statevector(initial_state)
+                elif final_bits is not None:
+                    # All the qubits were collapsed at the end of the previous
+                    # shot, so the state is a basis state: flipping the qubits
+                    # found in |1> brings it back to the ground state without
+                    # copying a full wavefunction.
+                    simulator.reset_to_ground(final_bits)
+
+                # Do each operation in this shot
+                classical_states[i] = self._run_program(simulator, program, snapshots)
+
+                # Only the ground state reset needs the previous shot to end
+                # in a basis state.
+                if prefix_length == 0 and i < self._shots - 1:
+                    final_bits = simulator.collapse()
+        return classical_states
+
+    def _open_snapshots(self):
+        """Return where the snapshots of an experiment are recorded.
+
+        Returns:
+            dict or SnapshotSink: an empty dictionary keeping the snapshots in
+                memory, or a sink writing them to the ``snapshot_directory``
+                of the qobj config.
+        """
+        if self._snapshot_directory is None:
+            return {}
+        return SnapshotSink(self._snapshot_directory, self._snapshot_dedupe)
+
+    def _experiment_result(self, circuit, data, time_taken):
+        """Wrap the data of an experiment into its result dictionary.
+
+        Args:
+            circuit (QobjExperiment): Qobj experiment
+            data (dict): the data of the experiment
+            time_taken (float): time spent running the experiment
+
+        Returns:
+            dict: the experiment result, as expected by ``Result.from_dict``.
+        """
         # Calculate creg_sizes
         pre_creg_sizes = {}
         for clbit_label in circuit.header.clbit_labels:
@@ -336,7 +503,136 @@ class QasmSimulatorProjectQ(BaseBackend):
                 'data': data,
                 'status': 'DONE',
                 'success': True,
-                'time_taken': (end-start)}
+                'time_taken': time_taken}
+
+    def _run_program(self, simulator, program, snapshots):
+        """Execute a compiled program once, for a single shot.
+
+        Args:
+            simulator (CppSimulator): simulator holding the qubits
+            program (list[CompiledOperation]): the compiled circuit
+            snapshots (dict or SnapshotSink): snapshots taken so far, updated
+                in place
+
+        Returns:
+            int: the classical state at the end of the shot.
+        """
+        apply_controlled_gate = simulator.apply_controlled_gate
+        measure_qubits = simulator.measure_qubits
+        classical_state = 0
+        for kind, matrix, targets, controls, clbit, label, conditional in program:
+            if conditional is not None:
+                mask, shift, value = conditional
+                if (classical_state & mask) >> shift != value:
+                    continue
+            if kind == GATE:
+                apply_controlled_gate(matrix, targets, controls)
+            elif kind == MEASURE:
+                bit = 1 << clbit
+                classical_state = ((classical_state & ~bit) |
+                                   (int(measure_qubits(targets)[0]) << clbit))
+            elif kind == RESET:
+                # Measure the qubit without recording it, and flip it if needed.
+                if measure_qubits(targets)[0]:
+                    apply_controlled_gate(X_MATRIX, targets, [])
+            else:
+                formatted_state = _format_statevector(simulator.statevector())
+                if isinstance(snapshots, SnapshotSink):
+                    snapshots.add(label, formatted_state)
+                elif label in snapshots:
+                    snapshots[label]['statevector'].append(formatted_state)
+                else:
+                    snapshots[label] = {'statevector': [formatted_state]}
+        return classical_state
+
+    def _sample_measurements(self, simulator, measurements, seed):
+        """Sample every shot at once from the current wavefunction.
+
+        Args:
+            simulator (CppSimulator): simulator holding the qubits
+            measurements (list): (qubit, clbit) pairs, in circuit order, with
+                a None qubit for the qubits reset before being measured
+            seed (int): seed for the sampling random number generator
+
+        Returns:
+            numpy.ndarray: the classical state of each shot, as uint64.
+        """
+        cumulative = np.cumsum(np.abs(simulator.statevector()) ** 2, dtype=np.float64)
+        rng = np.random.RandomState(seed % (1 << 32))
+        samples = np.searchsorted(cumulative,
+                                  rng.random_sample(self._shots) * cumulative[-1],
+                                  side='right')
+        samples = np.minimum(samples, len(cumulative) - 1)
+
+        classical_states = np.zeros(self._shots, dtype=np.int64)
+        for qubit, clbit in measurements:
+            bits = 0 if qubit is None else (samples >> qubit) & 1
+            classical_states = (classical_states & ~(1 << clbit)) | (bits << clbit)
+        return classical_states.astype(np.uint64)
+
+    def _shard_count(self, qobj, circuit):
+        """Number of tasks the shots of an experiment are split into.
+
+        Shots are only sharded, following the ``shot_shards`` option of the
+        qobj config, for experiments that are replayed shot by shot: the
+        others are sampled from a single simulation anyway.
+
+        Args:
+            qobj (Qobj): Qobj structure
+            circuit (QobjExperiment): Qobj experiment
+
+        Returns:
+            int: the number of shards, 1 for no sharding.
+        """
+        shot_shards = getattr(qobj.config, 'shot_shards', None) or 1
+        if shot_shards <= 1 or is_sampleable_experiment(circuit):
+            return 1
+        return min(shot_shards, qobj.config.shots)
+
+    def _footprint(self, qobj, circuit, shard):
+        """Estimate the memory of an experiment.
+
+        Every shot may take its own copy of each snapshot, and keeps its
+        classical state and memory entry.
+
+        Args:
+            qobj (Qobj): Qobj structure
+            circuit (QobjExperiment): Qobj experiment
+            shard (tuple): ``(index, count)`` share of the shots to run, or
+                None to run all of them
+
+        Returns:
+            Footprint: the working and retained bytes of the experiment.
+        """
+        n_qubits = circuit.config.n_qubits
+        dtype = precision_dtype(getattr(qobj.config, 'precision', None))
+        shots = qobj.config.shots
+        if shard is not None:
+            shots = _shard_shots(shots, *shard)
+        snapshot_bytes = 0
+        if getattr(qobj.config, 'snapshot_directory', None) is None:
+            snapshot_bytes = count_snapshots(circuit) * statevector_bytes(n_qubits, dtype)
+        return Footprint(simulation_bytes(n_qubits, dtype),
+                         shots * (snapshot_bytes + SHOT_BYTES))
+
+    def _cacheable(self, qobj, circuit):
+        """Whether the result of an experiment only depends on the qobj.
+
+        This is the case when the shots are drawn from a seed set in the qobj,
+        so that the result can be taken from a result cache. Results referring
+        to snapshot files are never cached, since the files may be removed.
+
+        Args:
+            qobj (Qobj): Qobj structure
+            circuit (QobjExperiment): Qobj experiment
+
+        Returns:
+            bool: True if the experiment is seeded.
+        """
+        if getattr(qobj.config, 'snapshot_directory', None) is not None:
+            return False
+        return (hasattr(qobj.config, 'seed') or
+                getattr(getattr(circuit, 'config', None), 'seed', None) is not None)
 
     def _validate(self, qobj):
         if qobj.config.shots == 1:
@@ -354,41 +650,141 @@ class QasmSimulatorProjectQ(BaseBackend):
         return
 
 
-def _get_register_specs(bit_labels):
+def _shard_shots(shots, shard, n_shards):
+    """Number of shots run by one shard.
+
+    Args:
+        shots (int): total number of shots
+        shard (int): index of the shard
+        n_shards (int): number of shards
+
+    Returns:
+        int: the shots of the shard, which add up to ``shots``.
     """
-    Get the number and size of unique registers from bit_labels list with an
-    iterator of register_name:size pairs.
+    size, extra = divmod(shots, n_shards)
+    return size + (1 if shard < extra else 0)
+
+
+def _shard_seed(seed, shard, n_shards):
+    """Seed of one shard, deterministically split from the experiment seed.
 
     Args:
-        bit_labels (list): this list is of the form::
+        seed (int): seed of the experiment
+        shard (int): index of the shard
+        n_shards (int): number of shards
+
+    Returns:
+        int: the seed of the shard.
+    """
+    seeds = np.random.RandomState(seed % (1 << 32)).randint(1 << 31, size=n_shards)
+    return int(seeds[shard])
 
-            [['reg1', 0], ['reg1', 1], ['reg2', 0]]
 
-            which indicates a register named "reg1" of size 2
-            and a register named "reg2" of size 1. This is the
-            format of classic and quantum bit labels in qobj
-            header.
-    Yields:
-        tuple: pairs of (register_name, size)
+def _classical_state_dtype(number_of_clbits):
+    """Return the dtype used to store one classical state per shot.
+
+    Classical states are packed into unsigned 64 bit integers, falling back
+    to Python integers for circuits with more memory slots than that.
+
+    Args:
+        number_of_clbits (int): number of memory slots of the circuit
+    Returns:
+        numpy.dtype: the dtype for the array of classical states.
     """
-    iterator = itertools.groupby(bit_labels, operator.itemgetter(0))
-    for register_name, sub_it in iterator:
-        yield register_name, max(ind[1] for ind in sub_it) + 1
+    if number_of_clbits <= 64:
+        return np.dtype(np.uint64)
+    return np.dtype(object)
+
+
+def precision_dtype(precision):
+    """Return the dtype of the statevectors for a precision option.
+
+    Args:
+        precision (str): 'complex64' or 'complex128', None for the default
+            double precision
+
+    Returns:
+        numpy.dtype: the complex dtype.
+
+    Raises:
+        ProjectQSimulatorError: if the precision is not valid.
+    """
+    if precision is None:
+        return np.dtype(np.complex128)
+    if precision not in ('complex64', 'complex128'):
+        raise ProjectQSimulatorError(
+            'Invalid precision "{}": expected "complex64" or "complex128".'.format(precision))
+    return np.dtype(precision)
+
+
+def _format_statevector(statevector):
+    """Format a statevector to Qiskit standards without copying it.
+
+    Qiskit expects each amplitude as a ``[real, imag]`` pair. Instead of
+    building one small Python list per amplitude, the complex array is
+    viewed as an array of shape ``(2**n, 2)`` sharing the same memory; the
+    conversion to lists only happens if the result is serialized.
+
+    Args:
+        statevector (numpy.ndarray): complex64 or complex128 statevector
+    Returns:
+        numpy.ndarray: real view of the statevector, of shape (2**n, 2), in
+            the precision of the statevector.
+    """
+    statevector = np.ascontiguousarray(statevector)
+    if statevector.dtype not in (np.complex64, np.complex128):
+        statevector = statevector.astype(np.complex128)
+    return statevector.view(statevector.real.dtype).reshape(-1, 2)
+
+
+def _close_snapshots(snapshots):
+    """Finish recording the snapshots of an experiment.
+
+    Args:
+        snapshots (dict or SnapshotSink): the snapshots kept in memory, or
+            the sink they were written to
+
+    Returns:
+        dict: the snapshots of the experiment result.
+    """
+    if isinstance(snapshots, SnapshotSink):
+        return snapshots.close()
+    return snapshots
+
+
+def _discard_snapshots(snapshots):
+    """Remove the snapshot files of an experiment that failed.
+
+    Args:
+        snapshots (dict or SnapshotSink): the snapshots kept in memory, or
+            the sink they were written to
+    """
+    if isinstance(snapshots, SnapshotSink):
+        snapshots.discard()
+
 
+def _format_result(classical_states, memory):
+    """Format the classical state of every shot to Qiskit standards.
 
-def _format_result(counts, cl_reg_nbits):
-    """Format the result bit string.
+    The histogram is computed directly on the integer classical states, and
+    only the distinct outcomes are formatted as hexadecimal strings spanning
+    all the memory slots. Splitting them into classical registers is left to
+    the ``creg_sizes`` of the result header.
 
-    This formats the result bit strings to Qiskit standards.
+    The outcome of every shot is left as the array of classical states, which
+    is cheaper to send back from a worker than a list of strings: it is only
+    formatted when the ``Result`` is built.
 
     Args:
-        counts (dict): dictionary of counts e.g. {'1111': 1000, '0000':5}
-        cl_reg_nbits (list): total amount of bits in classical register
+        classical_states (numpy.ndarray): classical state of every shot
+        memory (bool): whether to also return the outcome of every shot
     Returns:
-        dict: dictionary keys are reversed and given in hexadecimal.
+        dict: data with the 'counts' and, if requested, the 'memory' of the
+            experiment, e.g. {'counts': {'0x0': 5, '0xf': 1000}}.
     """
-    fcounts = {}
-    for key, value in counts.items():
-        new_key = key[-cl_reg_nbits[0]:]
-        fcounts[str(hex(int(new_key, 2)))] = value
-    return fcounts
+    values, frequencies = np.unique(classical_states, return_counts=True)
+    keys = [hex(int(value)) for value in values]
+    data = {'counts': dict(zip(keys, frequencies.tolist()))}
+    if memory:
+        data['memory'] = classical_states
+    return data
@@ -10,18 +10,34 @@ Interface to ProjectQ C++ quantum circuit simulator.
 """
 
 import logging
+import threading
+import time
 import uuid
+import weakref
 
+import numpy as np
 from qiskit.providers.models import BackendConfiguration
-from qiskit.qobj import QobjInstruction
-from qiskit.result import Result
 
 from qiskit_addon_projectq import QasmSimulatorProjectQ
-from .projectqjob import ProjectQJob
+from .projectqcache import StatevectorCache, instruction_prefix_keys
+from .projectqcompiler import bind_parameters, compile_circuit, fuse_gates
+from .projectqcppsim import CppSimulator
+from .projectqplanner import Footprint, count_snapshots, simulation_bytes, statevector_bytes
+from .projectqresult import result_from_dict
 from .projectqsimulatorerror import ProjectQSimulatorError
+from .qasm_simulator_projectq import (_close_snapshots, _discard_snapshots, _format_statevector,
+                                      precision_dtype)
 
 logger = logging.getLogger(__name__)
 
+# Default size limit of the cache of final statevectors of each process.
+DEFAULT_STATEVECTOR_CACHE_BYTES = 1 << 28
+
+# Caches of the final statevectors of the experiments run in this process,
+# by the cache id of the backend that ran them.
+_STATEVECTOR_CACHES = {}
+_STATEVECTOR_CACHES_LOCK = threading.Lock()
+
 
 class StatevectorSimulatorProjectQ(QasmSimulatorProjectQ):
     """ProjectQ C++ statevector simulator"""
@@ -59,20 +75,13 @@ class StatevectorSimulatorProjectQ(QasmSimulatorProjectQ):
         super().__init__(configuration=(configuration or
                                         BackendConfiguration.from_dict(self.DEFAULT_CONFIGURATION)),
                          provider=provider)
-
-    def run(self, qobj):
-        """Run qobj asynchronously.
-
-        Args:
-            qobj (QObj): QObj structure
-
-        Returns:
-            ProjectQJob: derived from BaseJob
-        """
-        job_id = str(uuid.uuid4())
-        projectq_job = ProjectQJob(self, job_id, self._run_job, qobj)
-        projectq_job.submit()
-        return projectq_job
+        # The id, unlike the backend itself, survives the trip to worker
+        # processes, which each keep their own cache for it.
+        self._statevector_cache_id = uuid.uuid4().hex
+        self._statevector_cache_bytes = getattr(provider, 'statevector_cache_bytes',
+                                                DEFAULT_STATEVECTOR_CACHE_BYTES)
+        self._use_statevector_cache = False
+        weakref.finalize(self, _discard_statevector_cache, self._statevector_cache_id)
 
     def _run_job(self, job_id, qobj):
         """Run circuits in qobj and return the result
@@ -93,28 +102,176 @@ class StatevectorSimulatorProjectQ(QasmSimulatorProjectQ):
                         'status': 'DONE'
                         }]
         """
+        return result_from_dict(self._run_qobj(job_id, qobj))
 
-        self._validate(qobj)
-        final_state_key = '32767'  # Internal key for final state snapshot
-        # Add final snapshots to circuits
-        for circuit in qobj.experiments:
-            circuit.instructions.append(QobjInstruction.from_dict(
-                {'name': 'snapshot', 'params': [final_state_key]}))
-        qobj.config.shots = 1
-        result_dict = super()._run_job(job_id, qobj).to_dict()
-        # Extract final state snapshot and move to 'statevector' data field
-        for res in result_dict['results']:
-            snapshots = res['data']['snapshots']
-            # Pop off final snapshot added above
-            final_state = snapshots.pop(final_state_key, None)
-            final_state = final_state['statevector'][0]
-            # Add final state to results data
-            res['data']['statevector'] = final_state
-            # Remove snapshot dict if empty
-            if snapshots == {}:
-                res['data'].pop('snapshots', None)
-
-        return Result.from_dict(result_dict)
+    def _configure(self, qobj, shard):
+        """Validate a qobj and set up this backend to run it.
+
+        Setting the ``statevector_cache`` option of the qobj config to False
+        runs its experiments without looking up or storing their final
+        statevectors in the cache of the backend.
+
+        Args:
+            qobj (Qobj): Qobj structure
+            shard (tuple): always None, experiments are not sharded
+        """
+        super()._configure(qobj, shard)
+        self._use_statevector_cache = (self._statevector_cache_bytes > 0 and
+                                       getattr(qobj.config, 'statevector_cache', True))
+
+    def run_circuit(self, circuit, seed=None):
+        """Run a circuit once and return its final statevector.
+
+        The number of shots of the qobj is ignored, and the qobj itself is
+        left untouched.
+
+        The final statevector is cached. When the instructions of a later
+        experiment start with all the instructions of a cached one, the
+        simulation resumes from its final state instead of the ground state.
+
+        Args:
+            circuit (QobjExperiment): Qobj experiment
+            seed (int): unused, the statevector does not depend on a seed
+
+        Returns:
+            dict: A dictionary of results which looks something like:
+
+                {
+                "data":
+                    {
+                    "statevector": array([[0.707, 0.], [0., 0.], [0., 0.], [0.707, 0.]]),
+                    },
+                "status": --status (string)--
+                }
+        """
+        # pylint: disable=unused-argument
+        self._number_of_qubits = circuit.config.n_qubits
+        self._number_of_clbits = circuit.config.memory_slots
+        self._shots = 1
+        start = time.time()
+        simulator = CppSimulator(self._number_of_qubits, 0, self._dtype)
+        keys = []
+        resume_at = 0
+        cache = None
+        if self._use_statevector_cache:
+            cache = _statevector_cache(self._statevector_cache_id, self._statevector_cache_bytes)
+            keys = instruction_prefix_keys(circuit)
+            for length in range(len(keys) - 1, 0, -1):
+                cached_state = cache.get(keys[length])
+                # A state cached in single precision does not resume a
+                # double precision experiment, and conversely.
+                if cached_state is not None and cached_state.dtype == self._dtype:
+                    simulator.set_statevector(cached_state)
+                    resume_at = length
+                    break
+        program = fuse_gates(compile_circuit(circuit, self._configuration.backend_name,
+                                             resume_at),
+                             self._fusion_width)
+
+        snapshots = self._open_snapshots()
+        try:
+            self._run_program(simulator, program, snapshots)
+            statevector = simulator.statevector()
+            snapshots = _close_snapshots(snapshots)
+        except BaseException:
+            _discard_snapshots(snapshots)
+            raise
+        if cache is not None and len(keys) == len(circuit.instructions) + 1:
+            cache.put(keys[-1], statevector)
+
+        data = {'statevector': _format_statevector(statevector)}
+        if snapshots != {}:
+            data['snapshots'] = snapshots
+        end = time.time()
+        return self._experiment_result(circuit, data, end - start)
+
+    def _sweep_circuit(self, circuit, program, slots, parameters):
+        """Compute the final statevector for every binding of the parameters.
+
+        Args:
+            circuit (QobjExperiment): Qobj experiment of the template
+            program (list[CompiledOperation]): the compiled template
+            slots (list[tuple]): its parametrized gates
+            parameters (numpy.ndarray): the bindings, one per row
+
+        Returns:
+            numpy.ndarray: the complex statevectors, of shape
+                ``(bindings, 2**n_qubits)``.
+        """
+        self._number_of_qubits = circuit.config.n_qubits
+        simulator = CppSimulator(self._number_of_qubits, 0, self._dtype)
+        statevectors = np.zeros((len(parameters), 1 << self._number_of_qubits),
+                                dtype=self._dtype)
+        for index, values in enumerate(parameters.tolist()):
+            if index > 0:
+                simulator.reset()
+            bound = fuse_gates(bind_parameters(program, slots, values,
+                                               self._configuration.backend_name),
+                               self._fusion_width)
+            self._run_program(simulator, bound, {})
+            statevectors[index] = simulator.statevector()
+        return statevectors
+
+    def _sweep_bytes(self, qobj, bindings):
+        """Estimate the memory of the result of a sweep.
+
+        Args:
+            qobj (Qobj): Qobj structure with the single experiment of the
+                template
+            bindings (int): number of bindings of the parameters
+
+        Returns:
+            int: the number of bytes of one statevector per binding, in the
+                precision of the qobj config.
+        """
+        dtype = precision_dtype(getattr(qobj.config, 'precision', None))
+        return bindings * statevector_bytes(qobj.experiments[0].config.n_qubits, dtype)
+
+    def _shard_count(self, qobj, circuit):
+        """The statevector of an experiment is computed once: never shard it.
+
+        Args:
+            qobj (Qobj): Qobj structure
+            circuit (QobjExperiment): Qobj experiment
+
+        Returns:
+            int: always 1.
+        """
+        return 1
+
+    def _footprint(self, qobj, circuit, shard):
+        """Estimate the memory of an experiment.
+
+        The experiment runs once, and keeps its final statevector and one
+        copy of each snapshot that is not written to a file.
+
+        Args:
+            qobj (Qobj): Qobj structure
+            circuit (QobjExperiment): Qobj experiment
+            shard (tuple): always None, experiments are not sharded
+
+        Returns:
+            Footprint: the working and retained bytes of the experiment.
+        """
+        n_qubits = circuit.config.n_qubits
+        dtype = precision_dtype(getattr(qobj.config, 'precision', None))
+        snapshots = 0
+        if getattr(qobj.config, 'snapshot_directory', None) is None:
+            snapshots = count_snapshots(circuit)
+        return Footprint(simulation_bytes(n_qubits, dtype),
+                         (1 + snapshots) * statevector_bytes(n_qubits, dtype))
+
+    def _cacheable(self, qobj, circuit):
+        """The statevector of an experiment does not depend on a seed.
+
+        Args:
+            qobj (Qobj): Qobj structure
+            circuit (QobjExperiment): Qobj experiment
+
+        Returns:
+            bool: True, unless its snapshots are written to files.
+        """
+        return getattr(qobj.config, 'snapshot_directory', None) is None
 
     def _validate(self, qobj):
         """Semantic validations of the qobj which cannot be done via schemas.
@@ -132,3 +289,30 @@ class StatevectorSimulatorProjectQ(QasmSimulatorProjectQ):
                     raise ProjectQSimulatorError(
                         "In circuit {}: statevector simulator does not support measure or "
                         "reset.".format(circuit.header.name))
+
+
+def _statevector_cache(cache_id, max_bytes):
+    """Return the cache of a backend in this process, created on first use.
+
+    Args:
+        cache_id (str): the cache id of the backend
+        max_bytes (int): the size limit of the cache
+
+    Returns:
+        StatevectorCache: the cache.
+    """
+    with _STATEVECTOR_CACHES_LOCK:
+        cache = _STATEVECTOR_CACHES.get(cache_id)
+        if cache is None:
+            cache = _STATEVECTOR_CACHES[cache_id] = StatevectorCache(max_bytes)
+        return cache
+
+
+def _discard_statevector_cache(cache_id):
+    """Drop the cache of a backend that was garbage collected.
+
+    Args:
+        cache_id (str): the cache id of the backend
+    """
+    with _STATEVECTOR_CACHES_LOCK:
+        _STATEVECTOR_CACHES.pop(cache_id, None)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018, IBM.
+#
+# This source code is licensed under the Apache License, Version 2.0 found in
+# the LICENSE.txt file in the root directory of this source tree.
+
+# pylint: disable=invalid-name,missing-docstring,broad-except
+
+from test.common import QiskitProjectQTestCase
+
+import os
+import tempfile
+import unittest
+from projectq.ops import QubitOperator
+from qiskit import execute
+from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
+import qiskit.extensions.simulator  # pylint: disable=unused-import
+from qiskit_addon_projectq import ProjectQProvider
+from qiskit_addon_projectq.projectqsimulatorerror import ProjectQSimulatorError
+
+
+class ProbabilitySimulatorProjectQTest(QiskitProjectQTestCase):
+    """Test ProjectQ C++ probability simulator."""
+
+    def setUp(self):
+        self.projectq = ProjectQProvider()
+        self.projectq_sim = self.projectq.get_backend('projectq_probability_simulator')
+
+    def tearDown(self):
+        self.projectq.shutdown()
+
+    def test_probabilities(self):
+        """Test exact probabilities of the measured memory slots."""
+
+        qr = QuantumRegister(3, 'qr')
+        cr = ClassicalRegister(2, 'cr')
+        qc = QuantumCircuit(qr, cr)
+        qc.h(qr[0])
+        qc.cx(qr[0], qr[1])
+        qc.h(qr[2])
+        qc.measure(qr[0], cr[0])
+        qc.measure(qr[1], cr[1])
+
+        result = execute(qc, backend=self.projectq_sim).result()
+        self.assertEqual(result.status, 'COMPLETED')
+        probabilities = result.data(qc)['probabilities']
+
+        self.assertEqual(set(probabilities), {'0x0', '0x3'})
+        self.assertAlmostEqual(probabilities['0x0'], 1/2)
+        self.assertAlmostEqual(probabilities['0x3'], 1/2)
+
+    def test_expectation_values(self):
+        """Test exact expectation values of observables."""
+
+        qr = QuantumRegister(2, 'qr')
+        cr = ClassicalRegister(2, 'cr')
+        qc = QuantumCircuit(qr, cr)
+        qc.h(qr[0])
+        qc.cx(qr[0], qr[1])
+        qc.measure(qr, cr)
+
+        observables = ['Z0 Z1', 'X0 X1', QubitOperator('Z0', 0.5) + QubitOperator('Y0 Y1')]
+        result = execute(qc, backend=self.projectq_sim,
+                         config={'observables': observables}).result()
+        expectation_values = result.data(qc)['expectation_values']
+
+        self.assertAlmostEqual(expectation_values[0], 1)
+        self.assertAlmostEqual(expectation_values[1], 1)
+        self.assertAlmostEqual(expectation_values[2], -1)
+
+    def test_failed_experiment_removes_snapshot_files(self):
+        """Test that the snapshot files of a failed experiment are removed."""
+
+        qr = QuantumRegister(2, 'qr')
+        cr = ClassicalRegister(2, 'cr')
+        qc = QuantumCircuit(qr, cr)
+        qc.h(qr[0])
+        qc.snapshot('0')
+        qc.measure(qr, cr)
+
+        with tempfile.TemporaryDirectory() as directory:
+            # The observable acts on a qubit the circuit does not have, which
+            # is only found once the snapshot is written.
+            with self.assertRaises(ProjectQSimulatorError):
+                execute(qc, backend=self.projectq_sim,
+                        config={'observables': ['Z5'],
+                                'snapshot_directory': directory}).result()
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_mid_circuit_measurement(self):
+        """Test that gates after a measurement are rejected."""
+
+        qr = QuantumRegister(1, 'qr')
+        cr = ClassicalRegister(1, 'cr')
+        qc = QuantumCircuit(qr, cr)
+        qc.measure(qr, cr)
+        qc.h(qr[0])
+
+        with self.assertRaises(ProjectQSimulatorError):
+            execute(qc, backend=self.projectq_sim).result()
+
+
+if __name__ == '__main__':
+    unittest.main()
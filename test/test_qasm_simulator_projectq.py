@@ -10,16 +10,21 @@
 from test._random_circuit_generator import RandomCircuitGenerator
 from test.common import QiskitProjectQTestCase
 
+import os
 import random
+import tempfile
+import threading
 import unittest
 
 import numpy
 from scipy.stats import chi2_contingency
 
 from qiskit import (QuantumCircuit, QuantumRegister,
-                    ClassicalRegister, execute)
+                    ClassicalRegister, execute, compile as qiskit_compile)
 from qiskit import BasicAer
-from qiskit_addon_projectq import ProjectQProvider
+import qiskit.extensions.simulator  # pylint: disable=unused-import
+from qiskit_addon_projectq import ProjectQProvider, ResultCache, load_snapshot
+from qiskit_addon_projectq.projectqsimulatorerror import ProjectQSimulatorError
 
 
 class TestQasmSimulatorProjectQ(QiskitProjectQTestCase):
@@ -45,18 +50,19 @@ class TestQasmSimulatorProjectQ(QiskitProjectQTestCase):
         for _ in range(n_circuits):
             basis = list(random.sample(random_circuits.op_signature.keys(),
                                        random.randint(2, 7)))
-            if 'reset' in basis:
-                basis.remove('reset')
             if 'u0' in basis:
                 basis.remove('u0')
             random_circuits.add_circuits(1, basis=basis)
         cls.rqg = random_circuits
 
     def setUp(self):
-        ProjectQ = ProjectQProvider()
-        self.projectq_sim = ProjectQ.get_backend('projectq_qasm_simulator')
+        self.projectq = ProjectQProvider()
+        self.projectq_sim = self.projectq.get_backend('projectq_qasm_simulator')
         self.aer_sim = BasicAer.get_backend('qasm_simulator')
 
+    def tearDown(self):
+        self.projectq.shutdown()
+
     def test_gate_x(self):
         shots = 100
         qr = QuantumRegister(1)
@@ -86,6 +92,94 @@ class TestQasmSimulatorProjectQ(QiskitProjectQTestCase):
             with self.subTest(key=key):
                 self.assertTrue(key in ['0' * N, '1' * N])
 
+    def test_terminal_measurements_seeded(self):
+        shots = 1000
+        qr = QuantumRegister(3)
+        cr = ClassicalRegister(3)
+        qc = QuantumCircuit(qr, cr, name='test_terminal_measurements_seeded')
+        qc.h(qr[0])
+        qc.cx(qr[0], qr[1])
+        qc.x(qr[2])
+        qc.measure(qr, cr)
+        counts_1 = execute(qc, backend=self.projectq_sim, shots=shots,
+                           seed=42).result(timeout=30).get_counts(qc)
+        counts_2 = execute(qc, backend=self.projectq_sim, shots=shots,
+                           seed=42).result(timeout=30).get_counts(qc)
+        self.assertEqual(counts_1, counts_2)
+        self.assertEqual(set(counts_1), {'100', '111'})
+        self.assertEqual(sum(counts_1.values()), shots)
+
+    def test_largest_seed(self):
+        shots = 10
+        circuits = []
+        for index in range(2):
+            qr = QuantumRegister(1)
+            cr = ClassicalRegister(2)
+            qc = QuantumCircuit(qr, cr, name='test_largest_seed_{}'.format(index))
+            qc.measure(qr[0], cr[0])
+            qc.x(qr[0])
+            qc.measure(qr[0], cr[1])
+            circuits.append(qc)
+        # The second experiment is seeded past the range of the C++ simulator.
+        result = execute(circuits, backend=self.projectq_sim, shots=shots,
+                         seed=(1 << 32) - 1).result(timeout=30)
+        for qc in circuits:
+            self.assertEqual(result.get_counts(qc), {'10': shots})
+
+    def test_memory(self):
+        shots = 100
+        qr = QuantumRegister(2)
+        cr = ClassicalRegister(2)
+        qc = QuantumCircuit(qr, cr, name='test_memory')
+        qc.h(qr[0])
+        qc.cx(qr[0], qr[1])
+        qc.measure(qr, cr)
+        result = execute(qc, backend=self.projectq_sim, shots=shots,
+                         memory=True).result(timeout=30)
+        memory = result.get_memory(qc)
+        self.assertEqual(len(memory), shots)
+        self.assertTrue(set(memory) <= {'00', '11'})
+        counts = result.get_counts(qc)
+        for key, value in counts.items():
+            with self.subTest(key=key):
+                self.assertEqual(memory.count(key), value)
+
+    def test_memory_process_pool(self):
+        # The classical states of this many shots come back through shared
+        # memory, and are only formatted in the parent process.
+        shots = 1 << 17
+        qr = QuantumRegister(2)
+        cr = ClassicalRegister(2)
+        qc = QuantumCircuit(qr, cr, name='test_memory_process_pool')
+        qc.h(qr[0])
+        qc.cx(qr[0], qr[1])
+        qc.measure(qr, cr)
+        provider = ProjectQProvider(max_workers=1, executor_mode='process')
+        try:
+            result = execute(qc, backend=provider.get_backend('projectq_qasm_simulator'),
+                             shots=shots, memory=True).result(timeout=60)
+        finally:
+            provider.shutdown()
+        memory = result.get_memory(qc)
+        self.assertEqual(len(memory), shots)
+        self.assertEqual(set(memory), {'00', '11'})
+        self.assertEqual(memory.count('11'), result.get_counts(qc)['11'])
+
+    def test_multiple_classical_registers(self):
+        shots = 100
+        qr = QuantumRegister(3)
+        cr0 = ClassicalRegister(1)
+        cr1 = ClassicalRegister(2)
+        qc = QuantumCircuit(qr, cr0, cr1, name='test_multiple_classical_registers')
+        qc.x(qr[1])
+        qc.x(qr[2])
+        qc.measure(qr[0], cr0[0])
+        qc.measure(qr[1], cr1[0])
+        qc.measure(qr[2], cr1[1])
+        result_pq = execute(qc, backend=self.projectq_sim,
+                            shots=shots).result(timeout=30)
+        self.assertEqual(result_pq.get_counts(qc), {'11 0': shots})
+
     def test_random_circuits(self):
         for circuit in self.rqg.get_circuits():
             self.log.info(circuit.qasm())
@@ -107,6 +201,285 @@ class TestQasmSimulatorProjectQ(QiskitProjectQTestCase):
             with self.subTest(circuit=circuit):
                 self.assertGreater(result[1], 0.01)
 
+    def test_bounded_executor(self):
+        shots = 100
+        qr = QuantumRegister(2)
+        cr = ClassicalRegister(2)
+        qc = QuantumCircuit(qr, cr, name='test_bounded_executor')
+        qc.x(qr[0])
+        qc.measure(qr, cr)
+        provider = ProjectQProvider(max_workers=1, executor_mode='thread',
+                                    max_queue_size=2, memory_budget=1 << 20)
+        backend = provider.get_backend('projectq_qasm_simulator')
+        try:
+            release = threading.Event()
+            first = provider.executor.submit(release.wait, memory=1 << 20)
+            second = provider.executor.submit(sum, [1, 2], memory=1 << 20)
+            # the second job does not fit in the memory budget
+            self.assertFalse(second.running() or second.done())
+            # and the queue is full
+            with self.assertRaises(ProjectQSimulatorError):
+                provider.executor.submit(sum, [3, 4])
+            release.set()
+            self.assertTrue(first.result(timeout=30))
+            self.assertEqual(second.result(timeout=30), 3)
+            result = execute(qc, backend=backend, shots=shots).result(timeout=30)
+            self.assertEqual(result.get_counts(qc), {'01': shots})
+        finally:
+            provider.shutdown()
+
+    def test_queue_counts_jobs(self):
+        shots = 20
+        circuits = []
+        for index in range(4):
+            qr = QuantumRegister(2)
+            cr = ClassicalRegister(2)
+            qc = QuantumCircuit(qr, cr, name='test_queue_counts_jobs_{}'.format(index))
+            qc.x(qr[0])
+            qc.measure(qr[0], cr[0])
+            qc.measure(qr[1], cr[1])
+            qc.x(qr[1])
+            circuits.append(qc)
+        provider = ProjectQProvider(max_workers=3, executor_mode='thread', max_queue_size=1)
+        backend = provider.get_backend('projectq_qasm_simulator')
+        try:
+            # Four experiments on three workers, then three shot shards, each
+            # make a single job of several tasks.
+            result = execute(circuits, backend=backend, shots=shots).result(timeout=30)
+            for qc in circuits:
+                self.assertEqual(result.get_counts(qc), {'01': shots})
+            result = execute(circuits[0], backend=backend, shots=shots,
+                             config={'shot_shards': 3}).result(timeout=30)
+            self.assertEqual(result.get_counts(circuits[0]), {'01': shots})
+        finally:
+            provider.shutdown()
+
+    def test_experiments_split_across_workers(self):
+        shots = 100
+        circuits = []
+        for i in range(4):
+            qr = QuantumRegister(2)
+            cr = ClassicalRegister(2)
+            qc = QuantumCircuit(qr, cr, name='test_split_{}'.format(i))
+            qc.h(qr[0])
+            qc.measure(qr[0], cr[0])
+            qc.cx(qr[0], qr[1])
+            qc.measure(qr[1], cr[1])
+            circuits.append(qc)
+        serial = ProjectQProvider(max_workers=1, executor_mode='thread')
+        parallel = ProjectQProvider(max_workers=3, executor_mode='thread')
+        try:
+            result_serial = execute(circuits, backend=serial.get_backend('projectq_qasm_simulator'),
+                                    shots=shots, seed=42).result(timeout=30)
+            result_parallel = execute(circuits,
+                                      backend=parallel.get_backend('projectq_qasm_simulator'),
+                                      shots=shots, seed=42).result(timeout=30)
+        finally:
+            serial.shutdown()
+            parallel.shutdown()
+        for qc in circuits:
+            with self.subTest(circuit=qc.name):
+                self.assertEqual(result_serial.get_counts(qc), result_parallel.get_counts(qc))
+
+    def test_shot_shards(self):
+        shots = 301
+        qr = QuantumRegister(2)
+        cr = ClassicalRegister(2)
+        qc = QuantumCircuit(qr, cr, name='test_shot_shards')
+        qc.h(qr[0])
+        qc.measure(qr[0], cr[0])
+        qc.h(qr[1])
+        qc.cx(qr[0], qr[1])
+        qc.measure(qr[1], cr[1])
+        results = [execute(qc, backend=self.projectq_sim, shots=shots, seed=7, memory=True,
+                           config={'shot_shards': 3}).result(timeout=30)
+                   for _ in range(2)]
+        self.assertEqual(results[0].get_counts(qc), results[1].get_counts(qc))
+        self.assertEqual(results[0].get_memory(qc), results[1].get_memory(qc))
+        self.assertEqual(sum(results[0].get_counts(qc).values()), shots)
+        self.assertEqual(len(results[0].get_memory(qc)), shots)
+
+    def test_conditional(self):
+        shots = 200
+        qr = QuantumRegister(3)
+        cr = ClassicalRegister(2)
+        cr_flag = ClassicalRegister(1)
+        qc = QuantumCircuit(qr, cr, cr_flag, name='test_conditional')
+        qc.h(qr[0])
+        qc.measure(qr[0], cr_flag[0])
+        qc.x(qr[1]).c_if(cr_flag, 1)
+        qc.x(qr[2]).c_if(cr_flag, 0)
+        qc.measure(qr[1], cr[0])
+        qc.measure(qr[2], cr[1])
+        self.assertTrue(self.projectq_sim.configuration().conditional)
+        counts = execute(qc, backend=self.projectq_sim,
+                         shots=shots).result(timeout=30).get_counts(qc)
+        self.assertTrue(set(counts) <= {'1 01', '0 10'})
+        self.assertEqual(sum(counts.values()), shots)
+
+    def test_reset(self):
+        shots = 200
+        qr = QuantumRegister(2)
+        cr = ClassicalRegister(3)
+        qc = QuantumCircuit(qr, cr, name='test_reset')
+        qc.reset(qr[0])
+        qc.x(qr[1])
+        qc.h(qr[0])
+        qc.measure(qr[0], cr[0])
+        qc.reset(qr[0])
+        qc.reset(qr[1])
+        qc.measure(qr[0], cr[1])
+        qc.measure(qr[1], cr[2])
+        counts = execute(qc, backend=self.projectq_sim,
+                         shots=shots).result(timeout=30).get_counts(qc)
+        self.assertTrue(set(counts) <= {'000', '001'})
+        self.assertEqual(sum(counts.values()), shots)
+
+    def test_reset_mid_circuit(self):
+        shots = 200
+        qr = QuantumRegister(1)
+        cr = ClassicalRegister(2)
+        qc = QuantumCircuit(qr, cr, name='test_reset_mid_circuit')
+        qc.h(qr[0])
+        qc.measure(qr[0], cr[0])
+        qc.reset(qr[0])
+        qc.x(qr[0])
+        qc.measure(qr[0], cr[1])
+        counts = execute(qc, backend=self.projectq_sim,
+                         shots=shots).result(timeout=30).get_counts(qc)
+        self.assertTrue(set(counts) <= {'10', '11'})
+        self.assertEqual(sum(counts.values()), shots)
+
+    def test_reset_to_ground_phase(self):
+        shots = 20
+        qr = QuantumRegister(1)
+        cr = ClassicalRegister(2)
+        qc = QuantumCircuit(qr, cr, name='test_reset_to_ground_phase')
+        # The leading measurement makes each shot start from the ground state
+        # reset at the end of the previous one, whatever phase it carries.
+        qc.measure(qr[0], cr[0])
+        qc.h(qr[0])
+        qc.t(qr[0])
+        qc.snapshot('0')
+        qc.measure(qr[0], cr[1])
+        result = execute(qc, backend=self.projectq_sim, shots=shots, seed=11).result(timeout=30)
+        statevectors = numpy.array(result.data(qc)['snapshots']['0']['statevector'])
+        self.assertEqual(len(statevectors), shots)
+        for statevector in statevectors[1:]:
+            numpy.testing.assert_allclose(statevector, statevectors[0], atol=1e-7)
+
+    def test_sweep(self):
+        shots = 100
+        qr = QuantumRegister(2)
+        cr = ClassicalRegister(2)
+        qc = QuantumCircuit(qr, cr, name='test_sweep')
+        qc.u3(0, 0, 0, qr[0])
+        qc.cx(qr[0], qr[1])
+        qc.u1(0, qr[1])
+        qc.measure(qr, cr)
+        qobj = qiskit_compile(qc, backend=self.projectq_sim, shots=shots, seed=3)
+        parameters = [[0, 0, 0, 0],
+                      [numpy.pi, 0, 0, 0.5],
+                      [numpy.pi / 2, 0, 0, 0]]
+        counts = self.projectq_sim.sweep(qobj, parameters)
+        self.assertEqual(counts.shape, (3, 4))
+        self.assertEqual(counts[0].tolist(), [shots, 0, 0, 0])
+        self.assertEqual(counts[1].tolist(), [0, 0, 0, shots])
+        self.assertEqual(counts[2, 1] + counts[2, 2], 0)
+        self.assertEqual(counts[2].sum(), shots)
+        with self.assertRaises(ProjectQSimulatorError):
+            self.projectq_sim.sweep(qobj, [[0, 0, 0]])
+
+        # The dense counts of a wide classical register do not fit in memory.
+        cr_wide = ClassicalRegister(40)
+        qc_wide = QuantumCircuit(qr, cr_wide, name='test_sweep_wide')
+        qc_wide.u1(0, qr[0])
+        qc_wide.measure(qr[0], cr_wide[39])
+        qobj_wide = qiskit_compile(qc_wide, backend=self.projectq_sim, shots=shots)
+        with self.assertRaisesRegex(ProjectQSimulatorError, 'memory slots'):
+            self.projectq_sim.sweep(qobj_wide, [[0]])
+
+    def test_result_cache(self):
+        shots = 100
+        qr = QuantumRegister(2)
+        cr = ClassicalRegister(2)
+        qc = QuantumCircuit(qr, cr, name='test_result_cache')
+        qc.h(qr[0])
+        qc.cx(qr[0], qr[1])
+        qc.measure(qr, cr)
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(max_entries=4, directory=directory)
+            provider = ProjectQProvider(result_cache=cache)
+            backend = provider.get_backend('projectq_qasm_simulator')
+            try:
+                counts = [execute(qc, backend=backend, shots=shots,
+                                  seed=5).result(timeout=30).get_counts(qc)
+                          for _ in range(2)]
+                self.assertEqual(counts[0], counts[1])
+                self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+                # Unseeded experiments are never cached.
+                execute(qc, backend=backend, shots=shots).result(timeout=30)
+                self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+                # The on-disk store outlives the in-memory entries.
+                cache.clear()
+                self.assertEqual(os.listdir(directory), [])
+                execute(qc, backend=backend, shots=shots, seed=5).result(timeout=30)
+                fresh_cache = ResultCache(directory=directory)
+                provider.result_cache = fresh_cache
+                cached = execute(qc, backend=backend, shots=shots,
+                                 seed=5).result(timeout=30).get_counts(qc)
+                self.assertEqual(cached, counts[0])
+                self.assertEqual((fresh_cache.hits, fresh_cache.misses), (1, 0))
+            finally:
+                provider.shutdown()
+
+    def test_memory_budget(self):
+        qr = QuantumRegister(2)
+        cr = ClassicalRegister(2)
+        small = QuantumCircuit(qr, cr, name='small')
+        small.h(qr[0])
+        small.measure(qr, cr)
+        qr_large = QuantumRegister(16)
+        large = QuantumCircuit(qr_large, name='large')
+        large.h(qr_large[0])
+        large.snapshot('0')
+
+        provider = ProjectQProvider(memory_budget=1 << 20)
+        backend = provider.get_backend('projectq_qasm_simulator')
+        try:
+            counts = execute(small, backend=backend, shots=10).result(timeout=30).get_counts()
+            self.assertEqual(sum(counts.values()), 10)
+            with self.assertRaisesRegex(ProjectQSimulatorError, 'large'):
+                execute([small, large], backend=backend, shots=10)
+        finally:
+            provider.shutdown()
+
+    def test_snapshot_directory(self):
+        shots = 20
+        qr = QuantumRegister(1)
+        cr = ClassicalRegister(1)
+        qc = QuantumCircuit(qr, cr, name='test_snapshot_directory')
+        qc.h(qr[0])
+        qc.snapshot('0')
+        qc.measure(qr, cr)
+        with tempfile.TemporaryDirectory() as directory:
+            in_memory = execute(qc, backend=self.projectq_sim, shots=shots,
+                                seed=7).result().data(qc)['snapshots']['0']
+            for dedupe in (False, True):
+                result = execute(qc, backend=self.projectq_sim, shots=shots, seed=7,
+                                 config={'snapshot_directory': directory,
+                                         'snapshot_dedupe': dedupe}).result()
+                snapshot = result.data(qc)['snapshots']['0']
+                self.assertNotIn('statevector', snapshot)
+                statevectors = load_snapshot(snapshot)
+                self.assertEqual(statevectors.shape, (shots, 2, 2))
+                numpy.testing.assert_allclose(statevectors,
+                                              numpy.array(in_memory['statevector']))
+                rows = snapshot['statevector_files'][0]['rows']
+                self.assertEqual(len(set(rows)), 1 if dedupe else shots)
+
     def test_all_bits_measured(self):
         shots = 2
         qr = QuantumRegister(2)
@@ -9,17 +9,25 @@
 
 from test.common import QiskitProjectQTestCase
 
+import glob
+import os
 import unittest
-from qiskit import execute, QuantumCircuit, QuantumRegister, ClassicalRegister
+import numpy as np
+from qiskit import execute, compile as qiskit_compile
+from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
 from qiskit_addon_projectq import ProjectQProvider
+from qiskit_addon_projectq.projectqsimulatorerror import ProjectQSimulatorError
 
 
 class StatevectorSimulatorProjectQTest(QiskitProjectQTestCase):
     """Test ProjectQ C++ statevector simulator."""
 
     def setUp(self):
-        ProjectQ = ProjectQProvider()
-        self.projectq_sim = ProjectQ.get_backend('projectq_statevector_simulator')
+        self.projectq = ProjectQProvider()
+        self.projectq_sim = self.projectq.get_backend('projectq_statevector_simulator')
+
+    def tearDown(self):
+        self.projectq.shutdown()
 
     def test_sv_simulator_projectq(self):
         """Test final state vector for single circuit run."""
@@ -40,6 +48,28 @@ class StatevectorSimulatorProjectQTest(QiskitProjectQTestCase):
         self.assertAlmostEqual(abs(actual[2]), 0)
         self.assertAlmostEqual((abs(actual[3]))**2, 1/2)
 
+    def test_statevector_array(self):
+        """Verify the statevector is returned as an array, not a list"""
+
+        qr = QuantumRegister(3, 'qr')
+        qc = QuantumCircuit(qr)
+        qc.h(qr[0])
+        qc.cx(qr[0], qr[2])
+
+        for precision in ('complex64', 'complex128'):
+            with self.subTest(precision=precision):
+                result = execute(qc, backend=self.projectq_sim,
+                                 config={'precision': precision}).result()
+                data = result.data(qc)['statevector']
+                actual = result.get_statevector(qc)
+                self.assertIsInstance(data, np.ndarray)
+                self.assertIsInstance(actual, np.ndarray)
+                self.assertEqual(actual.dtype, np.dtype(precision))
+                # the complex amplitudes are a view of the result data
+                self.assertTrue(np.shares_memory(actual, data))
+                self.assertAlmostEqual(abs(actual[0])**2, 1/2, places=6)
+                self.assertAlmostEqual(abs(actual[5])**2, 1/2, places=6)
+
     def test_qubit_order(self):
         """Verify Qiskit qubit ordering in state vector"""
 
@@ -58,6 +88,168 @@ class StatevectorSimulatorProjectQTest(QiskitProjectQTestCase):
         self.assertAlmostEqual(abs(actual[2]), 0)
         self.assertAlmostEqual(abs(actual[3]), 0)
 
+    def test_qobj_untouched(self):
+        """Verify the submitted qobj can be run again unchanged"""
+
+        qr = QuantumRegister(2, 'qr')
+        cr = ClassicalRegister(2, 'cr')
+        qc = QuantumCircuit(qr, cr)
+        qc.h(qr[0])
+        qc.cx(qr[0], qr[1])
+
+        qobj = qiskit_compile(qc, backend=self.projectq_sim)
+        instructions = qobj.experiments[0].instructions[:]
+        shots = qobj.config.shots
+
+        first = self.projectq_sim.run(qobj).result().get_statevector(qc)
+        self.assertEqual(qobj.experiments[0].instructions, instructions)
+        self.assertEqual(qobj.config.shots, shots)
+        second = self.projectq_sim.run(qobj).result().get_statevector(qc)
+        for amplitude_1, amplitude_2 in zip(first, second):
+            self.assertAlmostEqual(amplitude_1, amplitude_2)
+
+    def test_large_statevector(self):
+        """Verify a statevector large enough to go through shared memory"""
+
+        N = 17
+        qr = QuantumRegister(N, 'qr')
+        qc = QuantumCircuit(qr)
+        qc.x(qr[N - 1])
+
+        result = execute(qc, backend=self.projectq_sim).result()
+        self.assertEqual(result.status, 'COMPLETED')
+        actual = result.get_statevector(qc)
+
+        self.assertEqual(len(actual), 2 ** N)
+        self.assertAlmostEqual((abs(actual[2 ** (N - 1)]))**2, 1)
+        self.assertAlmostEqual(abs(actual[0]), 0)
+
+    @unittest.skipUnless(os.path.isdir('/dev/shm'), 'needs /dev/shm')
+    def test_failed_job_releases_shared_memory(self):
+        """Verify a failed task does not leak the arrays of the others"""
+
+        N = 17
+        qr = QuantumRegister(N, 'qr')
+        qc_large = QuantumCircuit(qr)
+        qc_large.x(qr[0])
+        qr_small = QuantumRegister(1, 'qr')
+        qc_bad = QuantumCircuit(qr_small)
+        qc_bad.h(qr_small[0])
+
+        provider = ProjectQProvider(max_workers=2, executor_mode='process')
+        backend = provider.get_backend('projectq_statevector_simulator')
+        try:
+            qobj = qiskit_compile([qc_large, qc_bad], backend=backend)
+            qobj.experiments[1].instructions[0].name = 'unknown'
+            before = set(glob.glob('/dev/shm/projectq_*.npy'))
+            with self.assertRaises(ProjectQSimulatorError):
+                backend.run(qobj).result(timeout=60)
+            self.assertEqual(set(glob.glob('/dev/shm/projectq_*.npy')) - before, set())
+        finally:
+            provider.shutdown()
+
+    def test_fusion_width(self):
+        """Verify that gate fusion does not change the statevector"""
+
+        qr = QuantumRegister(3, 'qr')
+        qc = QuantumCircuit(qr)
+        qc.h(qr[0])
+        qc.t(qr[0])
+        qc.u3(0.3, 0.2, 0.1, qr[1])
+        qc.cx(qr[0], qr[1])
+        qc.s(qr[1])
+        qc.u2(0.4, 0.5, qr[2])
+        qc.cx(qr[1], qr[2])
+        qc.u1(0.6, qr[0])
+        qc.cx(qr[2], qr[0])
+
+        statevectors = [execute(qc, backend=self.projectq_sim,
+                                config={'fusion_width': width}).result().get_statevector(qc)
+                        for width in (0, 1, 2)]
+        for statevector in statevectors[1:]:
+            for amplitude_1, amplitude_2 in zip(statevectors[0], statevector):
+                self.assertAlmostEqual(amplitude_1, amplitude_2)
+
+    def test_prefix_cache(self):
+        """Verify circuits extending a cached one resume from its state"""
+
+        qr = QuantumRegister(3, 'qr')
+        qc = QuantumCircuit(qr)
+        qc.h(qr[0])
+        qc.cx(qr[0], qr[1])
+        qc_extended = QuantumCircuit(qr)
+        qc_extended.h(qr[0])
+        qc_extended.cx(qr[0], qr[1])
+        qc_extended.u3(0.3, 0.2, 0.1, qr[2])
+        qc_extended.cx(qr[1], qr[2])
+
+        execute(qc, backend=self.projectq_sim).result()
+        resumed = execute(qc_extended, backend=self.projectq_sim).result()
+        uncached = execute(qc_extended, backend=self.projectq_sim,
+                           config={'statevector_cache': False}).result()
+        for amplitude_1, amplitude_2 in zip(resumed.get_statevector(qc_extended),
+                                            uncached.get_statevector(qc_extended)):
+            self.assertAlmostEqual(amplitude_1, amplitude_2)
+
+    def test_statevector_cache_budget(self):
+        """Verify the statevector caches are set aside from the memory budget"""
+
+        provider = ProjectQProvider(max_workers=2, executor_mode='process',
+                                    memory_budget=1 << 30, statevector_cache_bytes=1 << 20)
+        try:
+            self.assertEqual(provider.executor.reserved_memory, 2 << 20)
+        finally:
+            provider.shutdown()
+        provider = ProjectQProvider(max_workers=2, executor_mode='thread',
+                                    memory_budget=1 << 30)
+        try:
+            self.assertEqual(provider.executor.reserved_memory, 1 << 28)
+        finally:
+            provider.shutdown()
+        with self.assertRaises(ProjectQSimulatorError):
+            ProjectQProvider(max_workers=2, executor_mode='process',
+                             memory_budget=1 << 20, statevector_cache_bytes=1 << 20)
+        # Without a budget, the caches do not eat into the physical memory.
+        provider = ProjectQProvider(max_workers=64, executor_mode='thread')
+        try:
+            self.assertEqual(provider.executor.reserved_memory, 0)
+        finally:
+            provider.shutdown()
+
+    def test_sweep(self):
+        """Verify the statevectors of a parameter sweep"""
+
+        qr = QuantumRegister(1, 'qr')
+        qc = QuantumCircuit(qr)
+        qc.u3(0, 0, 0, qr[0])
+
+        qobj = qiskit_compile(qc, backend=self.projectq_sim)
+        angles = [0, np.pi / 3, np.pi]
+        statevectors = self.projectq_sim.sweep(qobj, [[theta, 0, 0] for theta in angles])
+
+        self.assertEqual(statevectors.shape, (3, 2))
+        for theta, statevector in zip(angles, statevectors):
+            self.assertAlmostEqual(abs(statevector[0]), np.cos(theta / 2))
+            self.assertAlmostEqual(abs(statevector[1]), np.sin(theta / 2))
+
+    def test_single_precision(self):
+        """Verify statevectors returned in single precision"""
+
+        qr = QuantumRegister(2, 'qr')
+        qc = QuantumCircuit(qr)
+        qc.u3(0, 0, 0, qr[0])
+        qc.cx(qr[0], qr[1])
+
+        result = execute(qc, backend=self.projectq_sim,
+                         config={'precision': 'complex64'}).result()
+        actual = result.get_statevector(qc)
+        self.assertAlmostEqual(abs(actual[0]), 1, places=6)
+
+        qobj = qiskit_compile(qc, backend=self.projectq_sim, config={'precision': 'complex64'})
+        statevectors = self.projectq_sim.sweep(qobj, [[np.pi, 0, 0]])
+        self.assertEqual(statevectors.dtype, np.complex64)
+        self.assertAlmostEqual(abs(statevectors[0, 3]), 1, places=6)
+
 
 if __name__ == '__main__':
     unittest.main()